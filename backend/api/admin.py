@@ -3,6 +3,7 @@ from django.utils.safestring import mark_safe
 
 from .models import (Favourites, Ingredient, Recipe, IngredientInRecipe,
                      ShoppingCart, Tag)
+from .services import add_recipe, remove_recipe
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -20,10 +21,11 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (RecipeIngredientInline,)
     empty_value_display = "-пусто-"
 
-    @admin.display(description='Количество в избранных')
+    @admin.display(description='Количество в избранных',
+                   ordering='favorites_count')
     def favorite_count(self, obj):
         """Получаем количество избранных."""
-        return obj.in_favourites.count()
+        return obj.favorites_count
 
     @admin.display(description='Теги')
     @mark_safe
@@ -52,11 +54,38 @@ class TagAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
-@admin.register(Favourites)
-class FavouritesAdmin(admin.ModelAdmin):
+class RecipeLinkAdmin(admin.ModelAdmin):
+    """Добавление и удаление связей через сервисные функции.
+
+    Так счётчики рецептов и суммы списков покупок остаются согласованными.
+    """
     list_display = ("user", "recipe")
 
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return ("user", "recipe")
+        return super().get_readonly_fields(request, obj)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            return super().save_model(request, obj, form, change)
+        link = add_recipe(self.model, obj.user, obj.recipe)
+        if link is not None:
+            obj.pk = link.pk
+
+    def delete_model(self, request, obj):
+        remove_recipe(self.model, obj.user, obj.recipe_id)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset.select_related('user'):
+            self.delete_model(request, obj)
+
+
+@admin.register(Favourites)
+class FavouritesAdmin(RecipeLinkAdmin):
+    pass
+
 
 @admin.register(ShoppingCart)
-class Shopping_cartAdmin(admin.ModelAdmin):
-    list_display = ("user", "recipe")
+class Shopping_cartAdmin(RecipeLinkAdmin):
+    pass
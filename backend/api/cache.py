@@ -0,0 +1,97 @@
+"""Версии закэшированных данных.
+
+Версия — это момент последнего изменения группы данных, хранящийся
+в общем кэше. Ключи закэшированных значений включают версии, поэтому
+для инвалидации достаточно обновить версию, не удаляя сами значения.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+RECIPES_VERSION = 'recipes'
+RECIPE_VERSION = 'recipe:{recipe_id}'
+RECIPE_COUNTERS_VERSION = 'recipe_counters:{recipe_id}'
+USER_VERSION = 'user:{user_id}'
+USER_FLAGS_VERSION = 'recipe_flags:{user_id}'
+FOLLOWS_VERSION = 'follows:{user_id}'
+CART_VERSION = 'cart:{user_id}'
+TAGS_VERSION = 'tags'
+INGREDIENTS_VERSION = 'ingredients'
+TRENDING_VERSION = 'trending'
+
+
+def make_version_key(name):
+    return f'version:{name}'
+
+
+def make_key(prefix, *parts):
+    """Собирает короткий ключ кэша из произвольных частей."""
+    payload = ':'.join(str(part) for part in parts)
+    return f'{prefix}:{hashlib.md5(payload.encode()).hexdigest()}'
+
+
+def get_versions(*names):
+    """Возвращает версии групп данных одним обращением к кэшу."""
+    keys = {make_version_key(name): name for name in names}
+    stored = cache.get_many(keys)
+    versions = {}
+    for key, name in keys.items():
+        version = stored.get(key)
+        if version is None:
+            version = time.time()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        versions[name] = version
+    return versions
+
+
+def get_version(name):
+    return get_versions(name)[name]
+
+
+def bump_version(*names):
+    """Отмечает группы данных изменёнными.
+
+    Внутри транзакции версия обновляется после её фиксации: иначе
+    параллельный запрос успел бы закэшировать старые данные под новой
+    версией. Вне транзакции версия обновляется сразу.
+    """
+    def bump():
+        version = time.time()
+        cache.set_many(
+            {make_version_key(name): version for name in names}, None
+        )
+
+    transaction.on_commit(bump)
+
+
+def bump_user_flags_version(user_id):
+    """Отмечает изменение избранного или списка покупок пользователя."""
+    bump_version(USER_FLAGS_VERSION.format(user_id=user_id))
+
+
+def bump_recipe_version(recipe_id):
+    """Отмечает изменение данных рецепта."""
+    bump_version(RECIPE_VERSION.format(recipe_id=recipe_id))
+
+
+def bump_user_version(user_id):
+    """Отмечает изменение профиля пользователя."""
+    bump_version(USER_VERSION.format(user_id=user_id))
+
+
+def bump_recipe_counters_versions(recipe_ids):
+    """Отмечает изменение счётчиков избранного и списков покупок."""
+    names = [RECIPE_COUNTERS_VERSION.format(recipe_id=recipe_id)
+             for recipe_id in recipe_ids]
+    if names:
+        bump_version(*names)
+
+
+def bump_cart_versions(user_ids):
+    """Отмечает изменение списков покупок пользователей."""
+    names = [CART_VERSION.format(user_id=user_id) for user_id in user_ids]
+    if names:
+        bump_version(*names)
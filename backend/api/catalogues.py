@@ -0,0 +1,161 @@
+"""Справочники, загруженные в память процесса.
+
+Каждый справочник хранит версию, с которой он был загружен, и раз в
+``CATALOGUE_CHECK_INTERVAL`` секунд сверяет её с версией в кэше.
+Изменения в текущем процессе сбрасывают справочник сразу через сигналы;
+изменения других процессов подхватываются, только если кэш общий
+(по умолчанию ``DatabaseCache``, см. проверку ``api.W001``).
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+
+from .cache import INGREDIENTS_VERSION, TAGS_VERSION, get_version
+from .models import Ingredient, Tag
+from backend.constants import CATALOGUE_CHECK_INTERVAL
+
+
+class Catalogue:
+    """Базовый справочник с ленивой загрузкой и проверкой версии.
+
+    ``load`` собирает новый неизменяемый снимок данных и подменяет его
+    одним присваиванием ``snapshot``, поэтому параллельные потоки видят
+    либо старый, либо новый снимок целиком. Методы чтения берут снимок
+    в локальную переменную один раз.
+    """
+
+    model = None
+    version_name = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0
+
+    def load(self):
+        raise NotImplementedError
+
+    def invalidate(self):
+        self.checked_at = 0
+        self.version = None
+
+    @property
+    def by_id(self):
+        return self.snapshot.by_id
+
+    def missing_ids(self, ids):
+        """Возвращает id из ``ids``, которых нет в базе.
+
+        Id, не найденные в справочнике, перепроверяются одним запросом:
+        справочник может отставать от базы на CATALOGUE_CHECK_INTERVAL.
+        """
+        self.refresh()
+        unknown = set(ids) - self.by_id.keys()
+        if unknown:
+            unknown -= set(self.model.objects.filter(
+                id__in=unknown).values_list('id', flat=True))
+        return unknown
+
+    def refresh(self, force=False):
+        """Перезагружает справочник, если его версия устарела.
+
+        ``force`` сверяет версию сразу, не дожидаясь интервала проверки.
+        """
+        now = time.monotonic()
+        if not force and self.version is not None and (
+                now - self.checked_at < CATALOGUE_CHECK_INTERVAL):
+            return self
+        version = get_version(self.version_name)
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.load()
+                    self.version = version
+        self.checked_at = now
+        return self
+
+
+TagSnapshot = namedtuple('TagSnapshot', 'tags by_id positions ids_by_slug')
+IngredientSnapshot = namedtuple('IngredientSnapshot', 'rows by_id keys')
+
+
+class TagCatalogue(Catalogue):
+    """Сериализованные теги: id → тег и slug → id."""
+
+    model = Tag
+    version_name = TAGS_VERSION
+
+    def load(self):
+        tags = tuple(Tag.objects.values('id', 'name', 'slug'))
+        self.snapshot = TagSnapshot(
+            tags=tags,
+            by_id={tag['id']: tag for tag in tags},
+            positions={tag['id']: index for index, tag in enumerate(tags)},
+            ids_by_slug={tag['slug']: tag['id'] for tag in tags},
+        )
+
+    def all(self):
+        return self.refresh().snapshot.tags
+
+    def get(self, tag_id):
+        return self.refresh().snapshot.by_id.get(tag_id)
+
+    def get_many(self, tag_ids):
+        """Возвращает теги по id в порядке сортировки тегов."""
+        snapshot = self.refresh().snapshot
+        return sorted(
+            (snapshot.by_id[tag_id] for tag_id in tag_ids
+             if tag_id in snapshot.by_id),
+            key=lambda tag: snapshot.positions.get(tag['id'], 0)
+        )
+
+    def ids_for_slugs(self, slugs):
+        snapshot = self.refresh().snapshot
+        return [snapshot.ids_by_slug[slug] for slug in slugs
+                if slug in snapshot.ids_by_slug]
+
+    def choices(self):
+        return [(tag['slug'], tag['name']) for tag in self.all()]
+
+
+class IngredientIndex(Catalogue):
+    """Префиксный индекс ингредиентов по названию без учёта регистра.
+
+    Хранит отсортированный массив названий в casefold и параллельный
+    массив готовых к отдаче строк ``IngredientSerializer``.
+    """
+
+    model = Ingredient
+    version_name = INGREDIENTS_VERSION
+
+    def load(self):
+        rows = tuple(sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda row: (row['name'].casefold(), row['name'])
+        ))
+        self.snapshot = IngredientSnapshot(
+            rows=rows,
+            by_id={row['id']: row for row in rows},
+            keys=tuple(row['name'].casefold() for row in rows),
+        )
+
+    def all(self):
+        return self.refresh().snapshot.rows
+
+    def get(self, ingredient_id):
+        return self.refresh().snapshot.by_id.get(ingredient_id)
+
+    def search(self, prefix, limit=None):
+        """Возвращает ингредиенты, название которых начинается с prefix."""
+        snapshot = self.refresh().snapshot
+        prefix = prefix.casefold()
+        start = bisect_left(snapshot.keys, prefix)
+        end = bisect_left(snapshot.keys, prefix + chr(0x10FFFF), start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return list(snapshot.rows[start:end])
+
+
+tag_catalogue = TagCatalogue()
+ingredient_index = IngredientIndex()
@@ -0,0 +1,29 @@
+"""Проверки настроек, от которых зависит согласованность кэша."""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Предупреждает, если кэш не общий для процессов.
+
+    Версии кэша обновляются в процессе, где изменились данные. С кэшем
+    в памяти процесса другие воркеры и management-команды этих
+    обновлений не видят, и справочники, фрагменты рецептов и списки
+    покупок остаются устаревшими до перезапуска.
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        f'Кэш {backend} не общий для процессов: изменения из других '
+        f'воркеров и management-команд не будут видны.',
+        hint='Укажите общий кэш в CACHE_BACKEND, например '
+             'django.core.cache.backends.memcached.PyMemcacheCache.',
+        id='api.W001',
+    )]
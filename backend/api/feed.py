@@ -0,0 +1,147 @@
+"""Лента новых рецептов авторов, на которых подписан пользователь.
+
+Рецепт записывается в ленты подписчиков при публикации (fan-out on
+write), поэтому страница ленты читается одним диапазоном индекса
+``FeedEntry``. Для авторов, у которых подписчиков больше
+``FEED_FANOUT_MAX_FOLLOWERS``, записи не создаются: их рецепты
+подмешиваются при чтении (fan-in).
+"""
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+
+from users.models import Follow
+from .cache import FOLLOWS_VERSION, get_version, make_key
+from .models import FeedEntry, Recipe
+from backend.constants import (FEED_BACKFILL_LIMIT,
+                               FEED_CELEBRITIES_CACHE_TIMEOUT,
+                               FEED_FANOUT_MAX_FOLLOWERS, IMPORT_BATCH_SIZE)
+
+
+def is_celebrity(author_id):
+    """Проверяет, что подписчиков автора больше порога рассылки."""
+    followers = Follow.objects.filter(author_id=author_id)
+    return followers[:FEED_FANOUT_MAX_FOLLOWERS + 1].count() > (
+        FEED_FANOUT_MAX_FOLLOWERS)
+
+
+def fan_out_recipe(recipe):
+    """Записывает новый рецепт в ленты подписчиков автора."""
+    if is_celebrity(recipe.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=recipe.author_id).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, recipe=recipe, pub_date=recipe.pub_date)
+         for user_id in follower_ids],
+        batch_size=IMPORT_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out_recipes(recipes):
+    """Записывает пачку новых рецептов в ленты подписчиков авторов.
+
+    Используется там, где рецепты создаются без сигналов ``post_save``.
+    """
+    by_author = defaultdict(list)
+    for recipe in recipes:
+        by_author[recipe.author_id].append(recipe)
+    celebrity_ids = Follow.objects.filter(
+        author_id__in=by_author).values('author_id').annotate(
+        total=Count('id')).filter(
+        total__gt=FEED_FANOUT_MAX_FOLLOWERS).values_list(
+        'author_id', flat=True)
+    for author_id in celebrity_ids:
+        del by_author[author_id]
+    follows = Follow.objects.filter(author_id__in=by_author).values_list(
+        'author_id', 'user_id')
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, recipe=recipe, pub_date=recipe.pub_date)
+         for author_id, user_id in follows.iterator()
+         for recipe in by_author[author_id]),
+        batch_size=IMPORT_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def backfill_feed(user, author):
+    """Добавляет в ленту последние рецепты автора после подписки."""
+    recipes = Recipe.objects.filter(author=author).order_by(
+        '-pub_date', '-id').values_list('id', 'pub_date')
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user=user, recipe_id=recipe_id, pub_date=pub_date)
+         for recipe_id, pub_date in recipes[:FEED_BACKFILL_LIMIT]],
+        ignore_conflicts=True
+    )
+
+
+def restore_fan_out(author_id):
+    """Заполняет ленты подписчиков, когда автор перестал быть fan-in.
+
+    Пока подписчиков было больше порога, рецепты автора подмешивались
+    при чтении и записей ``FeedEntry`` не получали. Когда подписчиков
+    становится ровно ``FEED_FANOUT_MAX_FOLLOWERS``, ленты читаются только
+    по записям, поэтому последние рецепты автора в них добавляются.
+    """
+    followers = Follow.objects.filter(author_id=author_id)
+    if followers[:FEED_FANOUT_MAX_FOLLOWERS + 1].count() != (
+            FEED_FANOUT_MAX_FOLLOWERS):
+        return
+    recipes = list(
+        Recipe.objects.filter(author_id=author_id).order_by(
+            '-pub_date', '-id').values_list('id', 'pub_date')
+        [:FEED_BACKFILL_LIMIT]
+    )
+    FeedEntry.objects.bulk_create(
+        (FeedEntry(user_id=user_id, recipe_id=recipe_id, pub_date=pub_date)
+         for user_id in followers.values_list('user_id', flat=True)
+         for recipe_id, pub_date in recipes),
+        batch_size=IMPORT_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def clear_feed(user, author):
+    """Убирает из ленты рецепты автора после отписки."""
+    FeedEntry.objects.filter(user=user, recipe__author=author).delete()
+
+
+def get_followed_celebrities(user):
+    """Возвращает id авторов с подмешиваемыми при чтении рецептами.
+
+    Результат кэшируется на короткое время: порог зависит от чужих
+    подписок, которые не меняют версию подписок пользователя.
+    """
+    key = make_key('feed_celebrities', user.id,
+                   get_version(FOLLOWS_VERSION.format(user_id=user.id)))
+    author_ids = cache.get(key)
+    if author_ids is None:
+        followers = Follow.objects.filter(
+            author=OuterRef('author')).order_by().values('author').annotate(
+            total=Count('id')).values('total')
+        author_ids = list(
+            Follow.objects.filter(user=user).annotate(
+                followers=Subquery(followers)
+            ).filter(followers__gt=FEED_FANOUT_MAX_FOLLOWERS)
+            .values_list('author_id', flat=True)
+        )
+        cache.set(key, author_ids, FEED_CELEBRITIES_CACHE_TIMEOUT)
+    return author_ids
+
+
+def get_feed(queryset, user):
+    """Ограничивает queryset рецептов лентой пользователя.
+
+    Добавляет аннотации ``feed_date`` и ``feed_recipe_id`` для
+    сортировки. Без авторов с fan-in лента читается по индексу записей
+    ``FeedEntry``.
+    """
+    celebrity_ids = get_followed_celebrities(user)
+    if not celebrity_ids:
+        return queryset.filter(feed_entries__user=user).annotate(
+            feed_date=F('feed_entries__pub_date'),
+            feed_recipe_id=F('feed_entries__recipe_id'),
+        )
+    return queryset.filter(
+        Q(Exists(FeedEntry.objects.filter(user=user, recipe=OuterRef('pk'))))
+        | Q(author_id__in=celebrity_ids)
+    ).annotate(feed_date=F('pub_date'), feed_recipe_id=F('id'))
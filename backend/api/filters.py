@@ -1,7 +1,10 @@
 import django_filters
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
+from .catalogues import tag_catalogue
 from .models import Ingredient, Recipe
+from backend.constants import RECIPE_ORDERING_FIELDS
 
 
 class IngredientFilter(FilterSet):
@@ -13,28 +16,45 @@ class IngredientFilter(FilterSet):
         fields = ("name",)
 
 
+class StableOrderingFilter(filters.OrderingFilter):
+    """Сортировка с id в конце, чтобы порядок страниц был однозначным."""
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        ordering = [self.get_ordering_value(param) for param in value]
+        return qs.order_by(*ordering, '-id')
+
+
 class RecipeFilter(FilterSet):
-    tags = django_filters.AllValuesMultipleFilter(
-        field_name='tags__slug', lookup_expr='contains'
+    tags = filters.MultipleChoiceFilter(
+        choices=lambda: tag_catalogue.choices(), method='filter_tags'
     )
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
 
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
+    ordering = StableOrderingFilter(fields=RECIPE_ORDERING_FIELDS)
 
     class Meta:
         model = Recipe
         fields = ('author', 'tags', 'is_favorited',
                   'is_in_shopping_cart')
 
+    def filter_tags(self, queryset, name, values):
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'),
+            tag_id__in=tag_catalogue.ids_for_slugs(values)
+        )))
+
     def filter_is_favorited(self, queryset, name, values):
         user = self.request.user
         if values and not user.is_anonymous:
-            return queryset.filter(in_favourites__user_id=user.id)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, values):
         user = self.request.user
         if values and not user.is_anonymous:
-            return queryset.filter(in_shopping_list__user_id=user.id)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
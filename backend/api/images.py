@@ -0,0 +1,303 @@
+"""Приём картинок, переданных в base64, и их уменьшенные копии.
+
+Данные декодируются кусками во временный файл, который держится в памяти
+только до ``IMAGE_SPOOL_MAX_SIZE``. Размер проверяется по длине base64 до
+декодирования, формат и размеры в пикселях — по заголовку, как только
+он декодирован, поэтому неподходящие картинки отклоняются рано.
+
+Уменьшенные копии (производные) создаются один раз после сохранения
+картинки — в фоновом потоке, чтобы не задерживать ответ, — и
+записываются в подкаталог ``IMAGE_DERIVATIVES_DIR`` рядом с оригиналом;
+их список хранится в JSON-поле модели вместе с именем оригинала,
+по которому они построены. Копии, не созданные из-за остановки процесса,
+догенерирует команда ``generate_image_derivatives``.
+"""
+import base64
+import binascii
+import logging
+import posixpath
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+from rest_framework.exceptions import ValidationError
+
+from backend.constants import (IMAGE_DECODE_CHUNK_SIZE, IMAGE_DECODE_ERROR,
+                               IMAGE_DERIVATIVE_FORMATS,
+                               IMAGE_DERIVATIVE_QUALITY,
+                               IMAGE_DERIVATIVES_DIR, IMAGE_DIMENSIONS_ERROR,
+                               IMAGE_HEADER_ERROR, IMAGE_HEADER_MAX_SIZE,
+                               IMAGE_INVALID_ERROR, IMAGE_SIZE_ERROR,
+                               IMAGE_SPOOL_MAX_SIZE)
+
+logger = logging.getLogger(__name__)
+
+DATA_URL_RE = re.compile(r'data:image/[a-z0-9.+-]{1,32};base64,')
+
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def invalid_image():
+    return ValidationError(IMAGE_INVALID_ERROR.format(
+        formats=', '.join(IMAGE_FORMATS.values())))
+
+
+def dimensions_error():
+    return ValidationError(IMAGE_DIMENSIONS_ERROR.format(
+        max_dimension=settings.IMAGE_UPLOAD_MAX_DIMENSION,
+        max_pixels=settings.IMAGE_UPLOAD_MAX_PIXELS,
+    ))
+
+
+def get_decoded_size(data, start):
+    """Размер данных base64 из ``data[start:]`` после декодирования."""
+    length = len(data) - start
+    if length % 4:
+        raise ValidationError(IMAGE_DECODE_ERROR)
+    return length // 4 * 3 - data.count('=', max(len(data) - 2, start))
+
+
+def identify_image(file):
+    """Возвращает формат картинки по уже декодированному началу файла.
+
+    Возвращает None, если заголовка пока не хватает; отклоняет
+    неподдерживаемые форматы и слишком большие размеры.
+    """
+    position = file.tell()
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        raise dimensions_error()
+    except (OSError, SyntaxError, ValueError, EOFError, IndexError,
+            struct.error):
+        return None
+    finally:
+        file.seek(position)
+    if image_format not in IMAGE_FORMATS:
+        raise invalid_image()
+    if (max(width, height) > settings.IMAGE_UPLOAD_MAX_DIMENSION
+            or width * height > settings.IMAGE_UPLOAD_MAX_PIXELS):
+        raise dimensions_error()
+    return image_format
+
+
+def decode_base64_image(data):
+    """Декодирует картинку из data URL во временный файл.
+
+    Возвращает ``File`` с расширением по фактическому формату картинки.
+    """
+    header = DATA_URL_RE.match(data)
+    if header is None:
+        raise ValidationError(IMAGE_HEADER_ERROR)
+    start = header.end()
+    if get_decoded_size(data, start) > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise ValidationError(IMAGE_SIZE_ERROR.format(
+            max_size=settings.IMAGE_UPLOAD_MAX_SIZE))
+
+    file = SpooledTemporaryFile(max_size=IMAGE_SPOOL_MAX_SIZE)
+    image_format = None
+    try:
+        for offset in range(start, len(data), IMAGE_DECODE_CHUNK_SIZE):
+            file.write(base64.b64decode(
+                data[offset:offset + IMAGE_DECODE_CHUNK_SIZE], validate=True))
+            if image_format is None:
+                image_format = identify_image(file)
+                if image_format is None and (
+                        file.tell() >= IMAGE_HEADER_MAX_SIZE):
+                    raise invalid_image()
+        if image_format is None:
+            raise invalid_image()
+    except binascii.Error:
+        file.close()
+        raise ValidationError(IMAGE_DECODE_ERROR)
+    except ValidationError:
+        file.close()
+        raise
+    file.seek(0)
+    return File(file, name=f'image.{IMAGE_FORMATS[image_format]}')
+
+
+def get_derivative_name(name, size, extension):
+    """Имя производной: ``<каталог>/derivatives/<имя>_<размер>.<расш>``."""
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(
+        directory, IMAGE_DERIVATIVES_DIR, f'{stem}_{size}.{extension}')
+
+
+def prepare_image(image, image_format):
+    """Приводит картинку к режиму, который поддерживает формат."""
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (
+        'transparency' in image.info)
+    if image_format != 'JPEG' and has_alpha:
+        return image.convert('RGBA')
+    if not has_alpha:
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def get_derivative_formats():
+    """Форматы производных, которые умеет записывать установленный Pillow."""
+    Image.init()
+    return {
+        image_format: extension
+        for image_format, extension in IMAGE_DERIVATIVE_FORMATS.items()
+        if image_format in Image.SAVE
+    }
+
+
+def render_derivatives(file, name, sizes):
+    """Возвращает [(описание производной, содержимое)] для картинки.
+
+    Копии не увеличиваются: размер, совпадающий с уже полученным
+    для того же формата, пропускается.
+    """
+    with Image.open(file) as image:
+        image.draft('RGB', max(sizes.values()))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    rendered = []
+    for image_format, extension in get_derivative_formats().items():
+        source = prepare_image(image, image_format)
+        seen = set()
+        for size, box in sizes.items():
+            derivative = source.copy()
+            derivative.thumbnail(box, Image.LANCZOS)
+            if derivative.size in seen:
+                continue
+            seen.add(derivative.size)
+            content = BytesIO()
+            derivative.save(content, image_format,
+                            quality=IMAGE_DERIVATIVE_QUALITY)
+            width, height = derivative.size
+            rendered.append(({
+                'size': size,
+                'format': extension,
+                'name': get_derivative_name(name, size, extension),
+                'width': width,
+                'height': height,
+            }, content.getvalue()))
+    return rendered
+
+
+def make_derivatives(name, sizes, storage=default_storage):
+    """Создаёт производные картинки ``name`` в хранилище.
+
+    Возвращает значение для JSON-поля модели. Если картинку не удалось
+    прочитать, список производных пуст, и попытка не повторяется
+    до замены картинки.
+    """
+    derivatives = {'source': name, 'images': []}
+    if not name:
+        return derivatives
+    try:
+        with storage.open(name) as file:
+            rendered = render_derivatives(file, name, sizes)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return derivatives
+    for image, content in rendered:
+        storage.delete(image['name'])
+        image['name'] = storage.save(image['name'], ContentFile(content))
+        derivatives['images'].append(image)
+    return derivatives
+
+
+def delete_derivatives(derivatives, storage, keep=()):
+    """Удаляет файлы производных, кроме имён из ``keep``."""
+    for image in derivatives.get('images', ()):
+        if image['name'] not in keep:
+            storage.delete(image['name'])
+
+
+def refresh_derivatives(instance, field_name, derivatives_name, sizes,
+                        force=False):
+    """Пересоздаёт производные, если картинка объекта изменилась.
+
+    Сохраняет результат запросом ``update``, минуя сигналы модели.
+    Возвращает True, если производные были пересозданы.
+    """
+    field_file = getattr(instance, field_name)
+    current = getattr(instance, derivatives_name) or {}
+    if not force and current.get('source', '') == (field_file.name or ''):
+        return False
+    derivatives = make_derivatives(
+        field_file.name or '', sizes, field_file.storage)
+    delete_derivatives(
+        current, field_file.storage,
+        keep={image['name'] for image in derivatives['images']})
+    type(instance).objects.filter(pk=instance.pk).update(
+        **{derivatives_name: derivatives})
+    setattr(instance, derivatives_name, derivatives)
+    return True
+
+
+def derivatives_pending(instance, field_name, derivatives_name):
+    """Построены ли производные не по текущей картинке объекта."""
+    current = getattr(instance, derivatives_name) or {}
+    return current.get('source', '') != (
+        getattr(instance, field_name).name or '')
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='image-derivatives')
+
+
+def schedule_derivatives(instance, field_name, derivatives_name, sizes,
+                         on_refresh):
+    """Пересоздаёт производные после фиксации транзакции, если картинка
+    объекта изменилась.
+
+    Производные строятся в фоновом потоке (или сразу, если
+    ``IMAGE_DERIVATIVES_ASYNC`` выключен) по свежей строке объекта;
+    после пересоздания вызывается ``on_refresh(pk)``.
+    """
+    if not derivatives_pending(instance, field_name, derivatives_name):
+        return
+    model, pk = type(instance), instance.pk
+
+    def refresh():
+        instance = model.objects.only(
+            'pk', field_name, derivatives_name).filter(pk=pk).first()
+        if instance is not None and refresh_derivatives(
+                instance, field_name, derivatives_name, sizes):
+            on_refresh(pk)
+
+    def refresh_in_background():
+        try:
+            refresh()
+        except Exception:
+            logger.exception(
+                'Не удалось создать уменьшенные копии картинки %s #%s.',
+                model._meta.label, pk)
+        finally:
+            connection.close()
+
+    if settings.IMAGE_DERIVATIVES_ASYNC:
+        transaction.on_commit(lambda: _executor.submit(refresh_in_background))
+    else:
+        transaction.on_commit(refresh)
+
+
+def build_srcset(derivatives, build_url):
+    """Собирает ``{формат: "url 400w, url 1200w"}`` из производных."""
+    srcset = {}
+    for image in (derivatives or {}).get('images', ()):
+        srcset.setdefault(image['format'], []).append(
+            f'{build_url(image["name"])} {image["width"]}w')
+    return {
+        image_format: ', '.join(candidates)
+        for image_format, candidates in srcset.items()
+    } or None
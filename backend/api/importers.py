@@ -0,0 +1,65 @@
+"""Потоковое чтение файлов для загрузки данных пачками."""
+import csv
+import json
+from itertools import islice
+
+from backend.constants import IMPORT_READ_CHUNK_SIZE
+
+
+def batched(iterable, size):
+    """Разбивает итерируемый объект на списки не длиннее size."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_csv(file, fieldnames):
+    """Построчно читает CSV без заголовка."""
+    yield from csv.DictReader(file, fieldnames=fieldnames)
+
+
+def read_json_lines(file):
+    """Построчно читает JSON Lines.
+
+    Возвращает пары (номер строки, текст) для непустых строк; разбор
+    JSON остаётся вызывающему коду, чтобы ошибка в строке не прерывала
+    чтение файла.
+    """
+    for number, line in enumerate(file, start=1):
+        line = line.strip()
+        if line:
+            yield number, line
+
+
+def read_json(file, chunk_size=IMPORT_READ_CHUNK_SIZE):
+    """Потоково читает объекты из JSON-массива верхнего уровня.
+
+    Файл читается кусками по chunk_size символов, в памяти держится
+    только ещё не разобранный хвост.
+    """
+    decoder = json.JSONDecoder()
+    buffer, started = '', False
+    for chunk in iter(lambda: file.read(chunk_size), ''):
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise ValueError('Ожидается JSON-массив.')
+                buffer, started = buffer[1:], True
+                continue
+            buffer = buffer.lstrip(', \t\r\n')
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                break
+            yield item
+            buffer = buffer[end:]
+    raise ValueError('JSON-массив не завершён.')
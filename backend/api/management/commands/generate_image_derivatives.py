@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_recipe_version, bump_user_version
+from api.images import refresh_derivatives
+from api.models import Recipe
+from backend.constants import AVATAR_IMAGE_SIZES, RECIPE_IMAGE_SIZES
+from users.models import User
+
+
+class Command(BaseCommand):
+
+    help = '''Generates resized copies of recipe images and user avatars
+that do not have them yet, e.g. after upgrading existing media.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate all copies, e.g. after changing the sizes.'
+        )
+
+    def handle(self, *args, **options) -> None:
+        force = options['force']
+        recipes = users = 0
+        for recipe in Recipe.objects.only(
+                'id', 'image', 'image_derivatives').iterator():
+            if refresh_derivatives(recipe, 'image', 'image_derivatives',
+                                   RECIPE_IMAGE_SIZES, force=force):
+                bump_recipe_version(recipe.id)
+                recipes += 1
+        for user in User.objects.only(
+                'id', 'avatar', 'avatar_derivatives').iterator():
+            if refresh_derivatives(user, 'avatar', 'avatar_derivatives',
+                                   AVATAR_IMAGE_SIZES, force=force):
+                bump_user_version(user.id)
+                users += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated images of {recipes} recipes and {users} users.'
+        ))
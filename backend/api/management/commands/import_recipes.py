@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importers import read_json_lines
+from api.recipe_import import RecipeImporter
+from backend.constants import IMPORT_BATCH_SIZE
+from users.models import User
+
+
+class Command(BaseCommand):
+
+    help = '''Imports recipes from a JSON Lines file, one recipe per line.
+Images are given as a path (relative to --images-dir) or an http(s) URL,
+authors as usernames. Invalid lines are reported and skipped.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the JSON Lines file.')
+        parser.add_argument(
+            '--author',
+            help='Username used for lines without an "author" field.'
+        )
+        parser.add_argument(
+            '--images-dir',
+            help='Directory image paths are resolved against '
+                 '(MEDIA_ROOT by default).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Number of lines saved per transaction.'
+        )
+
+    def handle(self, *args, **options) -> None:
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive.')
+        author = None
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(f'User {options["author"]} not found.')
+        importer = RecipeImporter(
+            default_author=author, images_root=options['images_dir'],
+            batch_size=options['batch_size']
+        )
+        path = Path(options['path'])
+        with open(path, encoding='utf8', errors='replace') as file:
+            report = importer.run(read_json_lines(file))
+
+        for line, messages in report.errors:
+            for message in messages:
+                self.stderr.write(f'{path}:{line}: {message}')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Processed {report.processed} lines from {path} in '
+                f'{report.elapsed:.2f}s ({report.rate:.0f} lines/s): '
+                f'{report.created} recipes created, '
+                f'{len(report.errors)} lines failed.'
+            )
+        )
@@ -1,9 +1,14 @@
-import csv
+import time
+from pathlib import Path
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from api.cache import INGREDIENTS_VERSION, bump_version
+from api.importers import batched, read_csv, read_json
 from api.models import Ingredient
+from backend.constants import IMPORT_BATCH_SIZE
 
 
 class Command(BaseCommand):
@@ -14,18 +19,90 @@ class Command(BaseCommand):
 
     FIELD_NAMES = ('name', 'measurement_unit')
 
-    help = f'''Populates Database with the Data from csv-File Located within
-{PATH_DATA}'''
+    FORMATS = ('csv', 'json')
+
+    help = f'''Populates Database with the Data from csv- or json-File
+(by default {PATH_DATA}/{FILE_NAME}). Existing ingredients are skipped,
+so the command is safe to rerun.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=str(self.PATH.joinpath(self.FILE_NAME)),
+            help='Path to the csv- or json-File.'
+        )
+        parser.add_argument(
+            '--format', choices=self.FORMATS,
+            help='File format; detected by the extension if omitted.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Number of rows written per transaction.'
+        )
 
     def handle(self, *args, **options) -> None:
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in self.FORMATS:
+            raise CommandError(
+                f'Unknown format of {path}, use --format {self.FORMATS}.'
+            )
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive.')
 
-        with open(self.PATH.joinpath(self.FILE_NAME), encoding='utf8') as file:
-            reader = csv.DictReader(file, fieldnames=self.FIELD_NAMES)
-            Ingredient.objects.bulk_create(Ingredient(**_) for _ in reader)
+        inserted = skipped = 0
+        started = time.monotonic()
+        with open(path, encoding='utf8', newline='') as file:
+            rows = (read_csv(file, self.FIELD_NAMES) if file_format == 'csv'
+                    else read_json(file))
+            try:
+                for batch in batched(enumerate(rows, start=1),
+                                     options['batch_size']):
+                    batch_inserted = self.save_batch(batch)
+                    inserted += batch_inserted
+                    skipped += len(batch) - batch_inserted
+            except ValueError as error:
+                raise CommandError(f'{path}: {error}')
+        bump_version(INGREDIENTS_VERSION)
 
+        elapsed = time.monotonic() - started
+        total = inserted + skipped
         self.stdout.write(
             self.style.SUCCESS(
-                f'''Successfully Populated Database with the Data from
-csv-File Located within {self.PATH_DATA}'''
+                f'Processed {total} rows from {path} in {elapsed:.2f}s '
+                f'({total / elapsed if elapsed else total:.0f} rows/s): '
+                f'{inserted} inserted, {skipped} skipped.'
             )
         )
+
+    @transaction.atomic
+    def save_batch(self, batch):
+        """Вставляет новые ингредиенты пачки, возвращает их количество.
+
+        Ингредиент определяется парой (название, единица измерения):
+        новая единица для существующего названия — новый ингредиент.
+        ``bulk_create`` с ``ignore_conflicts`` молча пропускает строки,
+        поэтому вставленные пары считаются повторным запросом.
+        """
+        ingredients = set()
+        for number, row in batch:
+            if not isinstance(row, dict):
+                self.stderr.write(
+                    f'Row {number} skipped: expected an object, got {row!r}.'
+                )
+                continue
+            name = (row.get('name') or '').strip()
+            unit = (row.get('measurement_unit') or '').strip()
+            if name and unit:
+                ingredients.add((name, unit))
+        stored = Ingredient.objects.filter(
+            name__in={name for name, _ in ingredients}
+        ).values_list('name', 'measurement_unit')
+        existing = set(stored)
+        new = [
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in ingredients - existing
+        ]
+        if not new:
+            return 0
+        Ingredient.objects.bulk_create(new, ignore_conflicts=True)
+        return len(ingredients & set(stored.all()) - existing)
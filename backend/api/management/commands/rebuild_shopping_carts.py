@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from api.importers import batched
+from api.models import ShoppingCart
+from api.services import rebuild_shopping_carts
+from backend.constants import IMPORT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+
+    help = '''Recomputes per-user shopping cart ingredient totals from the
+recipes in the carts (all users by default).'''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'user_ids', nargs='*', type=int,
+            help='Ids of users to rebuild; all users with a cart if omitted.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Number of users rebuilt per transaction.'
+        )
+
+    def handle(self, *args, **options) -> None:
+        user_ids = options['user_ids'] or (
+            ShoppingCart.objects.order_by('user_id').values_list(
+                'user_id', flat=True).distinct().iterator()
+        )
+        total = 0
+        for batch in batched(user_ids, options['batch_size']):
+            rebuild_shopping_carts(batch)
+            total += len(batch)
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt shopping carts of {total} users.')
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from api.importers import batched
+from api.models import Recipe
+from api.services import recount_recipe_counters
+from backend.constants import IMPORT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+
+    help = '''Reconciles the favorites and shopping cart counters of recipes
+with the link tables (all recipes by default).'''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'recipe_ids', nargs='*', type=int,
+            help='Ids of recipes to check; all recipes if omitted.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Number of recipes checked per transaction.'
+        )
+
+    def handle(self, *args, **options) -> None:
+        recipe_ids = options['recipe_ids'] or (
+            Recipe.objects.order_by('id').values_list(
+                'id', flat=True).iterator()
+        )
+        total = fixed = 0
+        for batch in batched(recipe_ids, options['batch_size']):
+            fixed += recount_recipe_counters(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {total} recipes, fixed counters of {fixed}.'
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.trending import update_trending
+
+
+class Command(BaseCommand):
+
+    help = '''Moves the time-decayed trending scores of recipes forward from
+the last watermark, adding favourites and cart additions made since.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-interval', type=int, default=0,
+            help='Skip the update if the last one is more recent than this '
+                 'number of seconds.'
+        )
+
+    def handle(self, *args, **options) -> None:
+        started = time.monotonic()
+        updated = update_trending(min_interval=options['min_interval'])
+        if updated is None:
+            self.stdout.write('Trending scores are up to date.')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Added events of {updated} recipes to trending scores '
+            f'in {time.monotonic() - started:.2f}s.'
+        ))
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:35
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_favourites(apps, schema_editor):
+    Favourites = apps.get_model('api', 'Favourites')
+    first_ids = (
+        Favourites.objects.values('user_id', 'recipe_id')
+        .annotate(first_id=Min('id'))
+        .values_list('first_id', flat=True)
+    )
+    Favourites.objects.exclude(id__in=list(first_ids)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_favourites, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='favourites',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favourite_recipe'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-17 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredient',
+            name='name',
+            field=models.CharField(help_text='Количество символов не более 200.', max_length=200, verbose_name='Название'),
+        ),
+    ]
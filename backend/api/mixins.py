@@ -0,0 +1,60 @@
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .cache import (FOLLOWS_VERSION, USER_FLAGS_VERSION, get_versions,
+                    make_key)
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы для list и retrieve.
+
+    ETag и Last-Modified вычисляются по версиям данных из
+    ``get_condition_versions`` до сериализации ответа. Если ответ
+    содержит поля пользователя (``condition_per_user``), в валидатор
+    авторизованного запроса входят его id и версии избранного, списка
+    покупок и подписок.
+    """
+
+    condition_per_user = False
+
+    def get_condition_versions(self):
+        """Возвращает имена версий ответа или None, если кэш не нужен."""
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        names = self.get_condition_versions()
+        if names is None:
+            return handler(request, *args, **kwargs)
+        user_id = None
+        if self.condition_per_user and request.user.is_authenticated:
+            user_id = request.user.id
+            names = (*names,
+                     USER_FLAGS_VERSION.format(user_id=user_id),
+                     FOLLOWS_VERSION.format(user_id=user_id))
+        versions = get_versions(*names)
+        etag = quote_etag(make_key(
+            'etag', request.get_full_path(), request.accepted_media_type,
+            user_id, *sorted(versions.items())
+        ))
+        last_modified = int(max(versions.values()))
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+        if self.condition_per_user:
+            patch_vary_headers(response, ('Authorization',))
+        return response
@@ -51,8 +51,17 @@ class Tag(models.Model):
 
 
 class Ingredient(IngredientTagRecipe):
-    """Модель списка ингредиентов."""
+    """Модель списка ингредиентов.
 
+    Ингредиент определяется парой (название, единица измерения), поэтому
+    одно название может встречаться с разными единицами.
+    """
+
+    name = models.CharField(
+        'Название',
+        max_length=LENG_MAX,
+        help_text=MAX_NUMBER_OF_CHARACTERS
+    )
     measurement_unit = models.CharField(
         'Единица измерения',
         max_length=LENG_MAX,
@@ -93,6 +102,11 @@ class Recipe(models.Model):
         upload_to="api/recipes/",
         help_text="Картинка рецепта.",
     )
+    image_derivatives = models.JSONField(
+        "Уменьшенные копии картинки",
+        default=dict,
+        editable=False,
+    )
     text = models.TextField(
         "Описание рецепта",
         help_text="Описание рецепта.",
@@ -121,11 +135,29 @@ class Recipe(models.Model):
         "Дата публикации",
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        "В избранном",
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        "В списках покупок",
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ("-pub_date",)
+        indexes = (
+            models.Index(fields=("-pub_date", "-id"),
+                         name="recipe_pub_date_id_idx"),
+            models.Index(fields=("-favorites_count", "-id"),
+                         name="recipe_favorites_count_idx"),
+            models.Index(fields=("-in_carts_count", "-id"),
+                         name="recipe_in_carts_count_idx"),
+        )
 
     def __str__(self):
         return self.name
@@ -217,6 +249,14 @@ class ShoppingCart(models.Model):
         related_name='in_shopping_list',
         verbose_name='Рецепт'
     )
+    # Пусто у записей, добавленных до появления поля: их время неизвестно,
+    # и в рейтинг популярных рецептов они не попадают.
+    pub_date = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        null=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'список покупок'
@@ -233,6 +273,41 @@ class ShoppingCart(models.Model):
         return f'Рецепт {self.recipe} в списке покупок у {self.user}'
 
 
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Поддерживается при изменениях списка покупок и ингредиентов
+    рецептов из него; пересчитывается командой rebuild_shopping_carts.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField('Количество', default=0)
+
+    class Meta:
+        verbose_name = 'ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списка покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_cart_ingredient'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount} у {self.user}'
+
+
 class FavoriteAndShoppingCartModel(models.Model):
     """Абстрактная модель. Добавляет юзера и рецепт."""
     user = models.ForeignKey(
@@ -273,8 +348,97 @@ class Favourites(FavoriteAndShoppingCartModel):
     pub_date = models.DateTimeField(
         "Дата добавления",
         auto_now_add=True,
+        db_index=True,
     )
 
     class Meta:
         verbose_name = "Избранное"
         verbose_name_plural = "Избранные"
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_favourite_recipe'
+            ),
+        )
+
+
+class TrendingScore(models.Model):
+    """Затухающий со временем рейтинг популярности рецепта.
+
+    Пересчитывается командой update_trending от последней отметки
+    ``TrendingWatermark``, а не по всей истории.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='trending',
+        verbose_name='Рецепт'
+    )
+    score = models.FloatField('Рейтинг', default=0)
+
+    class Meta:
+        verbose_name = 'рейтинг рецепта'
+        verbose_name_plural = 'Рейтинг рецептов'
+        indexes = (
+            models.Index(fields=('-score', '-recipe'),
+                         name='trending_score_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.recipe}: {self.score:.2f}'
+
+
+class TrendingWatermark(models.Model):
+    """Момент, до которого события учтены в рейтинге."""
+
+    computed_at = models.DateTimeField('Рассчитано')
+
+    class Meta:
+        verbose_name = 'отметка рейтинга'
+        verbose_name_plural = 'Отметки рейтинга'
+
+    def __str__(self):
+        return f'{self.computed_at:%Y-%m-%d %H:%M:%S}'
+
+
+class FeedEntry(models.Model):
+    """Запись ленты подписок пользователя.
+
+    Создаётся при публикации рецепта для каждого подписчика автора
+    и при подписке — для последних рецептов автора. Рецепты авторов
+    с большим числом подписчиков в ленту не записываются и добавляются
+    при чтении.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField('Дата публикации рецепта')
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry'
+            ),
+        )
+        indexes = (
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='feed_entry_user_pub_date_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
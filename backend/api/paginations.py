@@ -1,8 +1,246 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from functools import reduce
 
-from backend.constants import PAGINATION_NUMBER
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django_filters import OrderingFilter
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .cache import USER_FLAGS_VERSION, get_versions, make_key
+from backend.constants import (APPROXIMATE_COUNT_MIN, COUNT_CACHE_TIMEOUT,
+                               INVALID_CURSOR, PAGINATION_NUMBER)
+
+
+class KeysetPagination(BasePagination):
+    """Keyset-пагинация по упорядоченному набору уникальных полей.
+
+    Позиция страницы кодируется в курсоре значениями полей сортировки
+    граничной записи, поэтому запрос страницы не использует OFFSET
+    и не считает общее количество записей.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size = PAGINATION_NUMBER
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        self.reverse, position = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = tuple(self.invert(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        try:
+            if position is not None:
+                queryset = queryset.filter(
+                    self.get_position_filter(ordering, position)
+                )
+            results = list(queryset[:self.page_size + 1])
+        except (ValidationError, ValueError, TypeError):
+            # Курсор прочитан, но значения в нём не подходят к полям.
+            raise NotFound(INVALID_CURSOR)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(True, self.page[0])
+
+    def get_position_filter(self, ordering, position):
+        """Строит условие «строго после позиции» для составного ключа."""
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = {
+                previous.lstrip('-'): value
+                for previous, value in zip(ordering[:index], position)
+            }
+            condition[f'{name}__{lookup}'] = position[index]
+            conditions.append(Q(**condition))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def encode_cursor(self, reverse, instance):
+        position = [
+            self.get_value(instance, field.lstrip('-'))
+            for field in self.ordering
+        ]
+        payload = json.dumps({'r': reverse, 'p': position}, default=str)
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor
+        )
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return False, None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            reverse, position = bool(payload['r']), payload['p']
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise NotFound(INVALID_CURSOR)
+        if not isinstance(position, list) or (
+                len(position) != len(self.ordering)):
+            raise NotFound(INVALID_CURSOR)
+        return reverse, position
+
+    @staticmethod
+    def get_value(instance, name):
+        return reduce(getattr, name.split('__'), instance)
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, хранящий общее количество объектов в кэше.
+
+    При ``approximate=True`` на PostgreSQL количество берётся из оценки
+    планировщика, если таблица достаточно велика.
+    """
+
+    def __init__(self, object_list, per_page, count_key=None,
+                 approximate=False, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+        self.approximate = approximate
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return super().count
+        count = cache.get(self.count_key)
+        if count is None:
+            count = self.approximate and self.get_approximate_count()
+            if not count:
+                count = super().count
+            cache.set(self.count_key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+    def get_approximate_count(self):
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [self.object_list.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < APPROXIMATE_COUNT_MIN:
+            return None
+        return int(row[0])
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация с опциональным режимом курсора.
+
+    Если в запросе передан параметр ``cursor`` (в том числе пустой),
+    страница отдаётся через ``KeysetPagination``.
+
+    Для представлений с атрибутом ``count_cache_scope`` общее количество
+    кэшируется по нормализованному набору параметров фильтрации.
+    Параметры из ``count_cache_user_params`` зависят от пользователя
+    и делают ключ персональным. ``approximate_count`` разрешает оценку
+    количества для анонимных запросов без фильтров.
+    """
+
     page_size = PAGINATION_NUMBER
     page_size_query_param = "limit"
+    cursor_query_param = KeysetPagination.cursor_query_param
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.cursor_query_param in request.query_params:
+            self.cursor_paginator = KeysetPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        self.count_key, self.approximate = self.get_count_cache_options(
+            request, view
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def django_paginator_class(self, queryset, page_size):
+        return CachedCountPaginator(
+            queryset, page_size,
+            count_key=self.count_key, approximate=self.approximate
+        )
+
+    def get_count_cache_options(self, request, view):
+        """Возвращает ключ кэша количества и режим оценки."""
+        scope = getattr(view, 'count_cache_scope', None)
+        if scope is None:
+            return None, False
+        filterset_class = getattr(view, 'filterset_class', None)
+        names = sorted(
+            name for name, field in filterset_class.base_filters.items()
+            if not isinstance(field, OrderingFilter)
+        ) if filterset_class else ()
+        signature = [
+            (name, sorted(request.query_params.getlist(name)))
+            for name in names if name in request.query_params
+        ]
+        version_names = [scope]
+        user = request.user
+        user_params = getattr(view, 'count_cache_user_params', ())
+        if user.is_authenticated and any(
+                name in request.query_params for name in user_params):
+            signature.append(('user', user.id))
+            version_names.append(USER_FLAGS_VERSION.format(user_id=user.id))
+        versions = get_versions(*version_names)
+        count_key = make_key(
+            'count', scope, view.action, json.dumps(signature),
+            *sorted(versions.items())
+        )
+        approximate = (getattr(view, 'approximate_count', False)
+                       and user.is_anonymous and not signature)
+        return count_key, approximate
@@ -0,0 +1,326 @@
+"""Пакетный импорт рецептов из файла JSON Lines.
+
+Каждая строка файла — объект в формате ``RecipeWriteSerializer``, в котором
+``image`` — путь к файлу или URL, а ``author`` — имя пользователя.
+Строки проверяются и сохраняются пачками, каждая пачка — в своей
+транзакции. Ошибки отдельных строк попадают в отчёт и не прерывают импорт.
+"""
+import http.client
+import ipaddress
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import (HTTPHandler, HTTPSHandler, ProxyHandler,
+                            build_opener)
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.images import get_image_dimensions
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from users.models import User
+from .cache import RECIPES_VERSION, bump_version
+from .feed import fan_out_recipes
+from .images import delete_derivatives, make_derivatives
+from .importers import batched
+from .models import Recipe, RecipeIngredient
+from .serializers import RecipeImportSerializer
+from backend.constants import (IMPORT_BATCH_SIZE, IMPORT_IMAGE_MAX_SIZE,
+                               IMPORT_IMAGE_TIMEOUT, IMPORT_IMAGE_WORKERS,
+                               RECIPE_IMAGE_SIZES)
+
+URL_SCHEMES = ('http', 'https')
+
+
+def check_public_address(address):
+    """Отклоняет соединения с внутренними адресами (SSRF).
+
+    Проверяется адрес, с которым соединение уже установлено, поэтому
+    подмена DNS между проверкой и запросом не помогает.
+    """
+    if not ipaddress.ip_address(address.split('%')[0]).is_global:
+        raise ValueError('Загрузка картинок с внутренних адресов запрещена.')
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        super().connect()
+        check_public_address(self.sock.getpeername()[0])
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        super().connect()
+        check_public_address(self.sock.getpeername()[0])
+
+
+class PublicHTTPHandler(HTTPHandler):
+    def do_open(self, http_class, request, **kwargs):
+        return super().do_open(PublicHTTPConnection, request, **kwargs)
+
+
+class PublicHTTPSHandler(HTTPSHandler):
+    def do_open(self, http_class, request, **kwargs):
+        return super().do_open(PublicHTTPSConnection, request, **kwargs)
+
+
+# Без прокси из окружения: иначе проверялся бы адрес прокси. Переадресации
+# проходят через те же обработчики и проверяются так же.
+public_opener = build_opener(
+    ProxyHandler({}), PublicHTTPHandler, PublicHTTPSHandler)
+
+
+def check_image_url(url):
+    """Проверяет схему и, если задан список, хост URL картинки."""
+    parsed = urlparse(url)
+    allowed_hosts = settings.IMPORT_IMAGE_ALLOWED_HOSTS
+    if parsed.scheme not in URL_SCHEMES or not parsed.hostname or (
+            allowed_hosts and parsed.hostname not in allowed_hosts):
+        raise ValueError(f'Загрузка картинок с {url} запрещена.')
+
+
+def flatten_errors(detail, prefix=''):
+    """Разворачивает ошибки сериализатора в строки ``поле: сообщение``."""
+    if isinstance(detail, dict):
+        return [
+            message for field, errors in detail.items()
+            for message in flatten_errors(
+                errors, f'{prefix}.{field}' if prefix else str(field))
+        ]
+    if isinstance(detail, list):
+        if all(isinstance(error, str) for error in detail):
+            return [f'{prefix}: {error}' if prefix else str(error)
+                    for error in detail]
+        return [
+            message for index, errors in enumerate(detail)
+            for message in flatten_errors(errors, f'{prefix}[{index}]')
+        ]
+    return [f'{prefix}: {detail}' if prefix else str(detail)]
+
+
+class ImportReport:
+    """Итоги импорта: количество строк, созданные рецепты и ошибки."""
+
+    def __init__(self):
+        self.processed = 0
+        self.created = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        return self.processed / self.elapsed if self.elapsed else 0
+
+    def add_error(self, line, error):
+        self.errors.append((line, flatten_errors(error)))
+
+    def as_dict(self):
+        return {
+            'processed': self.processed,
+            'created': self.created,
+            'elapsed': round(self.elapsed, 2),
+            'rate': round(self.rate, 1),
+            'errors': [
+                {'line': line, 'errors': error} for line, error in self.errors
+            ],
+        }
+
+
+class RecipeImporter:
+    """Импорт рецептов из пар (номер строки, текст строки).
+
+    ``images_root`` — каталог, относительно которого разрешаются пути
+    к картинкам; файлы вне него не читаются. Картинка копируется
+    в хранилище под новым именем для каждого рецепта, даже если она уже
+    лежит в ``MEDIA_ROOT``: иначе рецепты делили бы файл и его уменьшенные
+    копии, и замена картинки одного рецепта удаляла бы копии другого.
+    """
+
+    def __init__(self, default_author=None, images_root=None,
+                 batch_size=IMPORT_BATCH_SIZE):
+        self.default_author = default_author
+        self.images_root = Path(images_root or settings.MEDIA_ROOT).resolve()
+        self.batch_size = batch_size
+        self.serializer = RecipeImportSerializer()
+        self.image_field = Recipe._meta.get_field('image')
+
+    def run(self, lines):
+        report = ImportReport()
+        for batch in batched(lines, self.batch_size):
+            self.import_batch(batch, report)
+        if report.created:
+            bump_version(RECIPES_VERSION)
+        report.errors.sort(key=lambda error: error[0])
+        report.finished = time.monotonic()
+        return report
+
+    def import_batch(self, batch, report):
+        report.processed += len(batch)
+        rows = self.validate_rows(batch, report)
+        rows = self.resolve_authors(rows, report)
+        rows = self.load_images(rows, report)
+        if not rows:
+            return
+        saved = []
+        try:
+            try:
+                with transaction.atomic():
+                    self.save_rows(rows)
+                saved = rows
+            except DatabaseError:
+                for row in rows:
+                    try:
+                        with transaction.atomic():
+                            self.save_rows([row])
+                        saved.append(row)
+                    except DatabaseError as error:
+                        report.add_error(row[0], str(error))
+        finally:
+            # Картинки сохранены до транзакции; у несохранённых строк
+            # их нужно удалить, чтобы не оставлять файлы без рецептов.
+            saved_ids = {id(row) for row in saved}
+            self.discard_images(
+                [row for row in rows if id(row) not in saved_ids])
+        report.created += len(saved)
+
+    def validate_rows(self, batch, report):
+        """Проверяет строки одним экземпляром сериализатора.
+
+        Теги и ингредиенты проверяются по справочникам процесса,
+        поэтому проверка не обращается к базе для каждой строки.
+        """
+        rows = []
+        for line, text in batch:
+            try:
+                rows.append(
+                    (line, self.serializer.run_validation(json.loads(text))))
+            except ValueError:
+                report.add_error(line, 'Некорректный JSON.')
+            except ValidationError as error:
+                report.add_error(line, error.detail)
+        return rows
+
+    def resolve_authors(self, rows, report):
+        """Находит авторов пачки одним запросом."""
+        authors = User.objects.in_bulk(
+            {data['author'] for _, data in rows if 'author' in data},
+            field_name='username'
+        )
+        resolved = []
+        for line, data in rows:
+            author = (authors.get(data['author']) if 'author' in data
+                      else self.default_author)
+            if author is None:
+                report.add_error(line, {'author': 'Автор не найден.'})
+                continue
+            data['author'] = author
+            resolved.append((line, data))
+        return resolved
+
+    def load_images(self, rows, report):
+        """Сохраняет картинки пачки и их уменьшенные копии параллельно."""
+        with ThreadPoolExecutor(IMPORT_IMAGE_WORKERS) as executor:
+            images = list(executor.map(
+                self.load_image, (data['image'] for _, data in rows)))
+        loaded = []
+        for (line, data), (name, derivatives, error) in zip(rows, images):
+            if error:
+                report.add_error(line, {'image': error})
+                continue
+            data['image'] = name
+            data['image_derivatives'] = derivatives
+            loaded.append((line, data))
+        return loaded
+
+    def load_image(self, source):
+        """Возвращает (имя файла в хранилище, производные, ошибка)."""
+        try:
+            if urlparse(source).scheme in URL_SCHEMES:
+                name = self.download_image(source)
+            else:
+                name = self.copy_image(source)
+        except (OSError, ValueError) as error:
+            return None, None, str(error)
+        return name, make_derivatives(name, RECIPE_IMAGE_SIZES), None
+
+    def download_image(self, url):
+        check_image_url(url)
+        with public_opener.open(url, timeout=IMPORT_IMAGE_TIMEOUT) as response:
+            check_image_url(response.geturl())
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit() and int(length) > IMPORT_IMAGE_MAX_SIZE:
+                raise ValueError('Картинка слишком большая.')
+            content = response.read(IMPORT_IMAGE_MAX_SIZE + 1)
+        if len(content) > IMPORT_IMAGE_MAX_SIZE:
+            raise ValueError('Картинка слишком большая.')
+        name = Path(urlparse(url).path).name or 'image'
+        return self.save_image(ContentFile(content, name=name))
+
+    def copy_image(self, source):
+        path = (self.images_root / source).resolve()
+        if self.images_root not in path.parents or not path.is_file():
+            raise ValueError(f'Файл {source} не найден.')
+        with path.open('rb') as file:
+            return self.save_image(File(file, name=path.name))
+
+    def save_image(self, file):
+        self.check_image(file)
+        name = self.image_field.generate_filename(None, file.name)
+        return default_storage.save(name, file)
+
+    @staticmethod
+    def discard_images(rows):
+        """Удаляет картинки и их уменьшенные копии у строк."""
+        for _, data in rows:
+            default_storage.delete(data['image'])
+            delete_derivatives(data['image_derivatives'], default_storage)
+
+    @staticmethod
+    def check_image(file):
+        if get_image_dimensions(file) == (None, None):
+            raise ValueError('Файл не является картинкой.')
+
+    def save_rows(self, rows):
+        """Создаёт рецепты пачки, их теги и ингредиенты.
+
+        Если база не возвращает id из массовой вставки, рецепты
+        сохраняются по одному; ленты подписчиков тогда заполняют
+        сигналы ``post_save``.
+        """
+        recipes = [
+            Recipe(
+                author=data['author'], name=data['name'], text=data['text'],
+                cooking_time=data['cooking_time'], image=data['image'],
+                image_derivatives=data['image_derivatives'],
+            )
+            for _, data in rows
+        ]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+            fan_out_recipes(recipes)
+        else:
+            for recipe in recipes:
+                recipe.save()
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+            for recipe, (_, data) in zip(recipes, rows)
+            for tag_id in data['tags']
+        ])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient['id'],
+                amount=ingredient['amount']
+            )
+            for recipe, (_, data) in zip(recipes, rows)
+            for ingredient in data['ingredients']
+        ])
@@ -0,0 +1,16 @@
+from rest_framework.renderers import JSONRenderer
+
+
+class PlainTextRenderer(JSONRenderer):
+    """Выбор текстового формата; ошибки отдаются в виде JSON-текста."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+
+class CSVRenderer(PlainTextRenderer):
+    """Выбор формата CSV; ошибки отдаются в виде JSON-текста."""
+
+    media_type = 'text/csv'
+    format = 'csv'
@@ -0,0 +1,184 @@
+"""Ранжированный нечёткий поиск ингредиентов.
+
+Результаты упорядочиваются по уровням: совпадение начала названия,
+совпадение начал слов (в любом порядке), затем триграммное сходство.
+Индекс хранится в памяти процесса; на PostgreSQL с расширением
+``pg_trgm`` сходство может считаться в базе данных.
+"""
+import heapq
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .cache import INGREDIENTS_VERSION
+from .catalogues import Catalogue, ingredient_index
+from .models import Ingredient
+from backend.constants import (INGREDIENT_SEARCH_MAX_CANDIDATES,
+                               INGREDIENT_SEARCH_MAX_POSTING,
+                               INGREDIENT_SEARCH_SIMILARITY)
+
+NON_WORD = re.compile(r'[\W_]+')
+
+SearchSnapshot = namedtuple(
+    'SearchSnapshot', 'rows names words word_positions postings sizes')
+
+
+def normalize(text):
+    """Приводит текст к виду для поиска: регистр, «ё», разделители."""
+    return NON_WORD.sub(' ', text.casefold().replace('ё', 'е')).strip()
+
+
+def trigrams(text):
+    """Множество триграмм слов текста, как в pg_trgm."""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class IngredientSearchIndex(Catalogue):
+    """Индекс начал слов и триграмм по названиям ингредиентов."""
+
+    version_name = INGREDIENTS_VERSION
+
+    def load(self):
+        # Индекс ингредиентов сверяется с версией сразу: иначе он может
+        # отдать строки старой версии, а этот индекс пометить себя новой.
+        rows = ingredient_index.refresh(force=True).snapshot.rows
+        names = [normalize(row['name']) for row in rows]
+        words = sorted(
+            (word, position)
+            for position, name in enumerate(names)
+            for word in set(name.split())
+        )
+        postings = defaultdict(list)
+        sizes = []
+        for position, name in enumerate(names):
+            grams = trigrams(name)
+            sizes.append(len(grams))
+            for gram in grams:
+                postings[gram].append(position)
+        self.snapshot = SearchSnapshot(
+            rows=rows,
+            names=tuple(names),
+            words=tuple(word for word, _ in words),
+            word_positions=tuple(position for _, position in words),
+            postings={gram: tuple(positions)
+                      for gram, positions in postings.items()},
+            sizes=tuple(sizes),
+        )
+
+    def search(self, query, limit):
+        """Возвращает не более limit ингредиентов, лучшие — первыми."""
+        snapshot = self.refresh().snapshot
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        results = list(ingredient_index.search(query, limit))
+        seen = {row['id'] for row in results}
+        for position in self.match_word_starts(snapshot, normalized):
+            if len(results) >= limit:
+                return results
+            row = snapshot.rows[position]
+            if row['id'] not in seen:
+                seen.add(row['id'])
+                results.append(row)
+        for position in self.match_trigrams(snapshot, normalized,
+                                            limit + len(seen)):
+            if len(results) >= limit:
+                break
+            row = snapshot.rows[position]
+            if row['id'] not in seen:
+                seen.add(row['id'])
+                results.append(row)
+        return results
+
+    def match_word_starts(self, snapshot, query):
+        """Позиции названий, где каждое слово запроса начинает слово."""
+        candidates = None
+        for token in sorted(set(query.split()), key=len, reverse=True):
+            start = bisect_left(snapshot.words, token)
+            end = bisect_left(snapshot.words, token + chr(0x10FFFF),
+                              start)
+            end = min(end, start + INGREDIENT_SEARCH_MAX_CANDIDATES)
+            positions = set(snapshot.word_positions[start:end])
+            candidates = (positions if candidates is None
+                          else candidates & positions)
+            if not candidates:
+                return []
+        return sorted(candidates,
+                      key=lambda position: (len(snapshot.names[position]),
+                                            position))
+
+    def match_trigrams(self, snapshot, query, limit):
+        """Позиции названий с наибольшим триграммным сходством."""
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            positions = snapshot.postings.get(gram, ())
+            if len(positions) <= INGREDIENT_SEARCH_MAX_POSTING:
+                shared.update(positions)
+        scored = (
+            (count / (len(grams) + snapshot.sizes[position] - count),
+             position)
+            for position, count in shared.items()
+        )
+        best = heapq.nlargest(
+            limit,
+            (item for item in scored
+             if item[0] >= INGREDIENT_SEARCH_SIMILARITY),
+            key=lambda item: (item[0], -item[1])
+        )
+        return [position for _, position in best]
+
+
+@lru_cache(maxsize=None)
+def pg_trgm_available():
+    """Проверяет, можно ли искать средствами pg_trgm."""
+    if not getattr(settings, 'INGREDIENT_SEARCH_PG_TRGM', False):
+        return False
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def search_ingredients_pg_trgm(query, limit):
+    """Ранжированный поиск в PostgreSQL через pg_trgm."""
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    word_starts = Q()
+    for token in query.split():
+        word_starts &= Q(name__iregex=r'(^|\s)' + re.escape(token))
+    return list(
+        Ingredient.objects.annotate(
+            rank=Case(
+                When(name__istartswith=query, then=Value(0)),
+                When(word_starts, then=Value(1)),
+                default=Value(2),
+                output_field=IntegerField(),
+            ),
+            similarity=TrigramSimilarity('name', query),
+        ).filter(
+            Q(rank__lt=2) | Q(similarity__gte=INGREDIENT_SEARCH_SIMILARITY)
+        ).order_by(
+            'rank', '-similarity', 'name'
+        ).values('id', 'name', 'measurement_unit')[:limit]
+    )
+
+
+ingredient_search_index = IngredientSearchIndex()
+
+
+def search_ingredients(query, limit):
+    """Ищет ингредиенты по запросу с опечатками и перестановкой слов."""
+    if pg_trgm_available():
+        return search_ingredients_pg_trgm(query, limit)
+    return ingredient_search_index.search(query, limit)
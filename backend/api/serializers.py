@@ -1,30 +1,60 @@
-import base64
-
-from django.core.files.base import ContentFile
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.db import models, transaction
-from rest_framework import (exceptions, fields, relations, serializers, status,
-                            validators)
+from rest_framework import (exceptions, fields, relations, serializers,
+                            status, validators)
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.validators import UniqueTogetherValidator
 
 from users.models import Follow, User
+from .cache import (INGREDIENTS_VERSION, RECIPE_VERSION, TAGS_VERSION,
+                    USER_VERSION, bump_recipe_version, get_versions, make_key)
+from .catalogues import ingredient_index, tag_catalogue
+from .images import (build_srcset, decode_base64_image,
+                     derivatives_pending)
 from .models import (Favourites, Ingredient, IngredientInRecipe, Recipe,
                      RecipeIngredient, ShoppingCart, Tag)
-from backend.constants import (ALREADY_BUY, COOKING_TIME_MIN_ERROR,
-                               DUBLICAT_USER, INGREDIENT_DUBLICATE_ERROR,
-                               INGREDIENT_MIN_AMOUNT_ERROR, RECIPE_IN_FAVORITE,
+from .services import change_recipe_ingredients, get_recipe_amounts
+from backend.constants import (ALREADY_BUY, BULK_MAX_RECIPES,
+                               COOKING_TIME_MIN_ERROR, DUBLICAT_USER,
+                               INGREDIENT_DUBLICATE_ERROR, INGREDIENT_ERROR,
+                               RECIPE_FRAGMENT_TIMEOUT, RECIPE_IN_FAVORITE,
                                SELF_FOLLOW, TAG_ERROR, TAG_UNIQUE_ERROR)
 
 
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
+        if isinstance(data, str) and data.startswith('data:'):
+            data = decode_base64_image(data)
+        return super().to_internal_value(data)
 
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
 
-        return super().to_internal_value(data)
+class SrcsetField(serializers.ReadOnlyField):
+    """Уменьшенные копии картинки в виде ``{формат: srcset}``."""
+
+    def to_representation(self, derivatives):
+        request = self.context.get('request')
+
+        def build_url(name):
+            url = default_storage.url(name)
+            return request.build_absolute_uri(url) if request else url
+
+        return build_srcset(derivatives, build_url)
+
+
+def does_not_exist(pk):
+    """Ошибка несуществующего id, как у PrimaryKeyRelatedField."""
+    return relations.PrimaryKeyRelatedField.default_error_messages[
+        'does_not_exist'].format(pk_value=pk)
+
+
+def get_recipes_limit(request):
+    """Возвращает параметр ``recipes_limit`` или None, если он не задан."""
+    try:
+        limit = int(request.query_params['recipes_limit'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    return limit if limit >= 0 else None
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -32,18 +62,34 @@ class UserSerializer(serializers.ModelSerializer):
 
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     avatar = Base64ImageField(required=False, allow_null=True)
+    avatar_srcset = SrcsetField(source='avatar_derivatives')
 
     class Meta:
         model = User
         fields = ('id', 'username',
                   'first_name', 'last_name', 'email',
-                  'is_subscribed', 'avatar',)
+                  'is_subscribed', 'avatar', 'avatar_srcset',)
 
     def get_is_subscribed(self, author):
         """Проверка подписки пользователей."""
         request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and request.user.follower.filter(author=author).exists())
+        if not request or not request.user.is_authenticated:
+            return False
+        return author.id in self.get_subscriptions(request.user)
+
+    def get_subscriptions(self, user):
+        """Возвращает id авторов, на которых подписан пользователь.
+
+        Множество загружается одним запросом и сохраняется в контексте,
+        общем для всех вложенных сериализаторов запроса.
+        """
+        subscriptions = self.context.get('subscriptions')
+        if subscriptions is None:
+            subscriptions = set(
+                user.follower.values_list('author_id', flat=True)
+            )
+            self.context['subscriptions'] = subscriptions
+        return subscriptions
 
     def create(self, validated_data: dict) -> User:
         """Создаёт нового пользователя с запрошенными полями.
@@ -92,16 +138,27 @@ class FollowSerializer(UserSerializer):
         return data
 
     def get_recipes_count(self, obj):
-        """Достаем количество рецептов."""
-        return obj.recipes.count()
+        """Достаем количество рецептов.
+
+        Берёт аннотацию ``recipes_count``, если она есть.
+        """
+        recipes_count = getattr(obj, 'recipes_count', None)
+        if recipes_count is None:
+            recipes_count = obj.recipes.count()
+        return recipes_count
 
     def get_recipes(self, obj):
-        """Достаем рецептs."""
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        """Достаем рецептs.
+
+        Берёт превью из ``recipe_previews`` в контексте, если оно есть.
+        """
+        previews = self.context.get('recipe_previews', {})
+        recipes = previews.get(obj.id)
+        if recipes is None:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = ShortRecipeSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
@@ -179,15 +236,35 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit")
 
 
+class RecipeReadListSerializer(serializers.ListSerializer):
+    """Список рецептов, загружающий закэшированные фрагменты разом."""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        recipes = list(iterable)
+        self.child.load_fragments(recipes)
+        representation = [
+            self.child.to_representation(recipe) for recipe in recipes
+        ]
+        self.child.save_fragments()
+        return representation
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
-    """ Сериализатор для возврата списка рецептов."""
+    """ Сериализатор для возврата списка рецептов.
 
-    tags = TagSerializer(many=True, read_only=True)
+    Не зависящая от пользователя часть рецепта кэшируется по версиям
+    рецепта, автора, тегов и ингредиентов; флаги пользователя
+    подставляются при каждом ответе.
+    """
+
+    tags = fields.SerializerMethodField(read_only=True)
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(many=True,
                                                required=True,
                                                source='ingredient_list')
     image = Base64ImageField()
+    image_srcset = SrcsetField(source='image_derivatives')
     is_favorited = fields.SerializerMethodField(read_only=True)
     is_in_shopping_cart = fields.SerializerMethodField(read_only=True)
 
@@ -195,8 +272,91 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
+            'is_in_shopping_cart', 'name', 'image', 'image_srcset', 'text',
+            'cooking_time', 'favorites_count', 'in_carts_count',
+        )
+        list_serializer_class = RecipeReadListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fragment_keys = {}
+        self.fragments = {}
+        self.new_fragments = {}
+        self.tag_ids = {}
+
+    def load_fragments(self, recipes):
+        """Загружает фрагменты рецептов одним обращением к кэшу."""
+        request = self.context.get('request')
+        base_url = request.build_absolute_uri('/') if request else ''
+        names = {TAGS_VERSION, INGREDIENTS_VERSION}
+        for recipe in recipes:
+            names.add(RECIPE_VERSION.format(recipe_id=recipe.id))
+            names.add(USER_VERSION.format(user_id=recipe.author_id))
+        versions = get_versions(*names)
+        keys = {
+            recipe.id: make_key(
+                'recipe_fragment', recipe.id, base_url,
+                versions[RECIPE_VERSION.format(recipe_id=recipe.id)],
+                versions[USER_VERSION.format(user_id=recipe.author_id)],
+                versions[TAGS_VERSION], versions[INGREDIENTS_VERSION],
+            )
+            for recipe in recipes
+        }
+        cached = cache.get_many(keys.values())
+        self.fragment_keys.update(keys)
+        self.fragments.update(
+            (recipe_id, cached.get(key)) for recipe_id, key in keys.items()
+        )
+        missing = [
+            recipe_id for recipe_id, key in keys.items() if key not in cached
+        ]
+        if missing:
+            # Рецепт без тегов получает пустой список, иначе get_tags
+            # запрашивал бы его теги отдельно.
+            for recipe_id in missing:
+                self.tag_ids.setdefault(recipe_id, [])
+            links = Recipe.tags.through.objects.filter(
+                recipe_id__in=missing).values_list('recipe_id', 'tag_id')
+            for recipe_id, tag_id in links:
+                self.tag_ids.setdefault(recipe_id, []).append(tag_id)
+
+    def save_fragments(self):
+        """Сохраняет собранные фрагменты одним обращением к кэшу."""
+        if self.new_fragments:
+            cache.set_many(self.new_fragments, RECIPE_FRAGMENT_TIMEOUT)
+            self.new_fragments = {}
+
+    def to_representation(self, instance):
+        if instance.id not in self.fragment_keys:
+            self.load_fragments([instance])
+        fragment = self.fragments.get(instance.id)
+        if fragment is None:
+            fragment = super().to_representation(instance)
+            self.fragments[instance.id] = fragment
+            # Пока копии картинки не готовы, фрагмент не кэшируется:
+            # иначе он остался бы без них под уже новой версией рецепта.
+            if not derivatives_pending(
+                    instance, 'image', 'image_derivatives'):
+                self.new_fragments[self.fragment_keys[instance.id]] = fragment
+            if not isinstance(self.parent, RecipeReadListSerializer):
+                self.save_fragments()
+        data = fragment.copy()
+        data['author'] = fragment['author'].copy()
+        data['author']['is_subscribed'] = (
+            self.fields['author'].get_is_subscribed(instance.author)
         )
+        data['is_favorited'] = self.get_is_favorited(instance)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(instance)
+        data['favorites_count'] = instance.favorites_count
+        data['in_carts_count'] = instance.in_carts_count
+        return data
+
+    def get_tags(self, recipe):
+        """Получает теги рецепта из справочника тегов."""
+        tag_ids = self.tag_ids.get(recipe.id)
+        if tag_ids is None:
+            tag_ids = recipe.tags.values_list('id', flat=True)
+        return tag_catalogue.get_many(tag_ids)
 
     def get_ingredients(self, recipe):
         """Получает список ингредиентов для рецепта."""
@@ -209,21 +369,32 @@ class RecipeReadSerializer(serializers.ModelSerializer):
 
     def get_is_favorited(self, obj):
         """Проверка - находится ли рецепт в избранном."""
-        request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and request.user.favourites.filter(recipe=obj).exists())
+        return self.get_user_flag(obj, 'is_favorited', 'favourites')
 
     def get_is_in_shopping_cart(self, obj):
         """Проверка - находится ли рецепт в списке покупок."""
+        return self.get_user_flag(obj, 'is_in_shopping_cart', 'shopping_list')
+
+    def get_user_flag(self, recipe, name, related_name):
+        """Возвращает флаг пользователя для рецепта.
+
+        Берёт значение из аннотации queryset, если она есть,
+        иначе выполняет запрос к связанной модели пользователя.
+        """
         request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and request.user.shopping_list.filter(recipe=obj).exists())
+        if not request or not request.user.is_authenticated:
+            return False
+        flag = getattr(recipe, name, None)
+        if flag is None:
+            flag = getattr(request.user, related_name).filter(
+                recipe=recipe).exists()
+        return flag
 
 
 class IngredientInRecipeWriteSerializer(serializers.ModelSerializer):
     """ Сериализатор для ингредиента в рецепте."""
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = IngredientInRecipe
@@ -326,9 +497,12 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
     """Короткий сериализатор рецепта."""
+
+    image_srcset = SrcsetField(source='image_derivatives')
+
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_srcset", "cooking_time")
 
 
 class FavoriteSerializer(serializers.ModelSerializer):
@@ -351,11 +525,23 @@ class FavoriteSerializer(serializers.ModelSerializer):
         ).data
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_MAX_RECIPES,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
 class RecipeWriteSerializer(serializers.ModelSerializer):
     """ Сериализатор для создание рецептов."""
 
-    tags = relations.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
-                                            many=True)
+    tags = serializers.ListField(child=serializers.IntegerField(min_value=1))
     author = UserSerializer(read_only=True)
     ingredients = IngredientInRecipeWriteSerializer(many=True)
     image = Base64ImageField(max_length=None, use_url=True)
@@ -371,35 +557,16 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         for ingredient in ingredients:
             IngredientInRecipe.objects.get_or_create(
                 recipe=recipe,
-                ingredient=ingredient['id'],
+                ingredient_id=ingredient['id'],
                 amount=ingredient['amount']
             )
 
-    def validate(self, data):
-        ingredients = data.get("ingredients")
-        tags = data.get("tags")
-        if not ingredients:
-            raise serializers.ValidationError(
-                "Необходимо добавить хотя бы один ингредиент."
-            )
-        if not tags:
-            raise serializers.ValidationError(
-                "Необходимо добавить хотя бы один тег."
-            )
-        if len(tags) != len(set(tags)):
-            raise serializers.ValidationError("Теги должны быть уникальными.")
-        if len(set(val["id"] for val in ingredients)) != len(ingredients):
-            raise serializers.ValidationError(
-                "Ингредиенты должны быть уникальными."
-            )
-        return data
-
     def add_ingredients(self, ingredients, recipe):
         RecipeIngredient.objects.bulk_create(
             [
                 RecipeIngredient(
                     recipe=recipe,
-                    ingredient=ingredient["id"],
+                    ingredient_id=ingredient["id"],
                     amount=ingredient["amount"],
                 )
                 for ingredient in ingredients
@@ -413,53 +580,112 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(author=request.user, **validated_data)
         recipe.tags.set(tags)
         self.add_ingredients(ingredients, recipe)
+        bump_recipe_version(recipe.id)
         return recipe
 
+    def update_tags(self, recipe, tags):
+        """Добавляет и удаляет только изменившиеся теги рецепта."""
+        new_ids = set(tags)
+        old_ids = set(Recipe.tags.through.objects.filter(
+            recipe=recipe).values_list('tag_id', flat=True))
+        if old_ids - new_ids:
+            recipe.tags.remove(*(old_ids - new_ids))
+        if new_ids - old_ids:
+            recipe.tags.add(*(new_ids - old_ids))
+
+    def update_ingredients(self, recipe, ingredients):
+        """Применяет к ингредиентам рецепта только разницу.
+
+        Новые строки вставляются, изменившиеся количества обновляются,
+        лишние строки удаляются. Возвращает старые и новые количества
+        {id ингредиента: количество}.
+        """
+        new_amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        rows, extra_ids = {}, []
+        for row in recipe.Recipe_ingredient.all():
+            if row.ingredient_id in rows:
+                extra_ids.append(row.id)
+            else:
+                rows[row.ingredient_id] = row
+        old_amounts = get_recipe_amounts([recipe.id]) if extra_ids else {
+            ingredient_id: row.amount for ingredient_id, row in rows.items()
+        }
+        changed = []
+        for ingredient_id, row in rows.items():
+            if ingredient_id not in new_amounts:
+                extra_ids.append(row.id)
+            elif row.amount != new_amounts[ingredient_id]:
+                row.amount = new_amounts[ingredient_id]
+                changed.append(row)
+        RecipeIngredient.objects.filter(id__in=extra_ids).delete()
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in rows
+        ])
+        return old_amounts, new_amounts
+
+    @transaction.atomic
     def update(self, instance, validated_data):
+        """Обновляет рецепт, затрагивая только изменившиеся связи.
+
+        При частичном обновлении теги и ингредиенты не меняются,
+        если их нет в запросе.
+        """
         if instance.author != self.context["request"].user:
             raise PermissionDenied(
                 "У вас нет прав на редактирование этого рецепта."
             )
-        image = validated_data.get("image")
-        if not image:
+        if "image" in validated_data and not validated_data["image"]:
             raise serializers.ValidationError(
                 'Поле "image" не может быть пустым.', code="invalid_image"
             )
-        tags = validated_data.pop("tags")
-        ingredients = validated_data.pop("ingredients")
+        tags = validated_data.pop("tags", None)
+        ingredients = validated_data.pop("ingredients", None)
         recipe = super().update(instance, validated_data)
-        if tags:
-            recipe.tags.clear()
-            recipe.tags.set(tags)
-        if ingredients:
-            recipe.ingredients.clear()
-            self.add_ingredients(ingredients, recipe)
+        if tags is not None:
+            self.update_tags(recipe, tags)
+        old_amounts = new_amounts = {}
+        if ingredients is not None:
+            old_amounts, new_amounts = self.update_ingredients(
+                recipe, ingredients)
+        change_recipe_ingredients(recipe, old_amounts, new_amounts)
+        bump_recipe_version(recipe.id)
         return recipe
 
     def validate_ingredients(self, value):
-        """Проверяем ингредиенты в рецепте."""
-        ingredients = self.initial_data.get('ingredients')
-        if len(ingredients) <= 0:
+        """Проверяем ингредиенты в рецепте.
+
+        Повторы ищутся по множеству id, существование всех ингредиентов
+        проверяется по справочнику процесса с одним запросом для
+        не найденных в нём id.
+        """
+        if not value:
             raise exceptions.ValidationError(
-                {'ingredients': INGREDIENT_MIN_AMOUNT_ERROR}
+                {'ingredients': INGREDIENT_ERROR}
             )
-        ingredients_list = []
-        for item in ingredients:
-            if item['id'] in ingredients_list:
-                raise exceptions.ValidationError(
-                    {'ingredients': INGREDIENT_DUBLICATE_ERROR}
-                )
-            ingredients_list.append(item['id'])
-            if int(item['amount']) <= 0:
-                raise exceptions.ValidationError(
-                    {'amount': INGREDIENT_MIN_AMOUNT_ERROR}
-                )
+        ids = [item['id'] for item in value]
+        if len(set(ids)) != len(ids):
+            raise exceptions.ValidationError(
+                {'ingredients': INGREDIENT_DUBLICATE_ERROR}
+            )
+        missing = ingredient_index.missing_ids(ids)
+        if missing:
+            raise exceptions.ValidationError([
+                {'id': [does_not_exist(pk)]} if pk in missing else {}
+                for pk in ids
+            ])
         return value
 
     def validate_cooking_time(self, data):
         """Проверяем время приготовления рецепта."""
-        cooking_time = self.initial_data.get('cooking_time')
-        if int(cooking_time) <= 0:
+        if data <= 0:
             raise serializers.ValidationError(
                 COOKING_TIME_MIN_ERROR
             )
@@ -467,18 +693,19 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
     def validate_tags(self, value):
         """Проверяем на наличие уникального тега."""
-        tags = value
-        if not tags:
+        if not value:
             raise exceptions.ValidationError(
                 {'tags': TAG_ERROR}
             )
-        tags_list = []
-        for tag in tags:
-            if tag in tags_list:
-                raise exceptions.ValidationError(
-                    {'tags': TAG_UNIQUE_ERROR}
-                )
-            tags_list.append(tag)
+        if len(set(value)) != len(value):
+            raise exceptions.ValidationError(
+                {'tags': TAG_UNIQUE_ERROR}
+            )
+        missing = tag_catalogue.missing_ids(value)
+        if missing:
+            raise exceptions.ValidationError(
+                [does_not_exist(pk) for pk in value if pk in missing]
+            )
         return value
 
     def to_representation(self, instance):
@@ -488,6 +715,16 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                                     context=context).data
 
 
+class RecipeImportSerializer(RecipeWriteSerializer):
+    """Строка файла импорта рецептов.
+
+    Картинка задаётся путём к файлу или URL, автор — именем пользователя.
+    """
+
+    image = serializers.CharField()
+    author = serializers.CharField(required=False)
+
+
 class AddShoppingListRecipeSerializer(AddFavoriteRecipeSerializer):
     """Сериализатор добавления рецептов в список покупок."""
 
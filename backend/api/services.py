@@ -0,0 +1,323 @@
+"""Операции со списками покупок и избранным."""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from users.models import User
+from .cache import (bump_cart_versions, bump_recipe_counters_versions,
+                    bump_user_flags_version)
+from .models import (Favourites, Recipe, RecipeIngredient, ShoppingCart,
+                     ShoppingCartIngredient)
+
+COUNTER_FIELDS = {
+    Favourites: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
+
+PREVIEW_COLUMNS = ('id', 'author_id', 'name', 'image', 'image_derivatives',
+                   'cooking_time')
+
+ADDED, EXISTS, REMOVED, ABSENT, NOT_FOUND = (
+    'added', 'exists', 'removed', 'absent', 'not_found'
+)
+
+
+def get_recipe_amounts(recipe_ids):
+    """Возвращает {id ингредиента: количество} для набора рецептов."""
+    return dict(
+        RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+        .values('ingredient_id').annotate(total=Sum('amount'))
+        .values_list('ingredient_id', 'total')
+    )
+
+
+def change_cart_amounts(user_ids, amounts):
+    """Прибавляет amounts к суммам ингредиентов в списках покупок.
+
+    Отрицательные значения вычитаются; строки с нулевой суммой удаляются.
+    Версии списков обновляются после записи сумм и фиксации транзакции.
+    """
+    user_ids = list(user_ids)
+    amounts = {
+        ingredient_id: amount
+        for ingredient_id, amount in amounts.items() if amount
+    }
+    if user_ids and amounts:
+        write_cart_amounts(user_ids, amounts)
+    bump_cart_versions(user_ids)
+
+
+def write_cart_amounts(user_ids, amounts):
+    ShoppingCartIngredient.objects.bulk_create(
+        [
+            ShoppingCartIngredient(
+                user_id=user_id, ingredient_id=ingredient_id
+            )
+            for user_id in user_ids
+            for ingredient_id, amount in amounts.items() if amount > 0
+        ],
+        ignore_conflicts=True
+    )
+    ingredients_by_amount = defaultdict(list)
+    for ingredient_id, amount in amounts.items():
+        ingredients_by_amount[amount].append(ingredient_id)
+    rows = ShoppingCartIngredient.objects.filter(user_id__in=user_ids)
+    for amount, ingredient_ids in ingredients_by_amount.items():
+        rows.filter(ingredient_id__in=ingredient_ids).update(
+            amount=F('amount') + amount
+        )
+    rows.filter(amount__lte=0).delete()
+
+
+def negate(amounts):
+    return {key: -value for key, value in amounts.items()}
+
+
+@transaction.atomic
+def add_to_shopping_cart(user, recipe_ids):
+    """Учитывает добавленные в список покупок рецепты."""
+    change_cart_amounts([user.id], get_recipe_amounts(recipe_ids))
+
+
+@transaction.atomic
+def remove_from_shopping_cart(user, recipe_ids):
+    """Учитывает удалённые из списка покупок рецепты."""
+    change_cart_amounts([user.id], negate(get_recipe_amounts(recipe_ids)))
+
+
+def change_recipe_ingredients(recipe, old_amounts, new_amounts):
+    """Переносит изменение рецепта в списки покупок, где он есть.
+
+    Версии этих списков обновляются, даже если ингредиенты не менялись.
+    """
+    delta = defaultdict(int, new_amounts)
+    for ingredient_id, amount in old_amounts.items():
+        delta[ingredient_id] -= amount
+    user_ids = ShoppingCart.objects.filter(recipe=recipe).values_list(
+        'user_id', flat=True)
+    change_cart_amounts(user_ids, delta)
+
+
+def remove_recipe_from_shopping_carts(recipe):
+    """Вычитает рецепт из списков покупок перед его удалением."""
+    change_recipe_ingredients(recipe, get_recipe_amounts([recipe.id]), {})
+
+
+@transaction.atomic
+def rebuild_shopping_carts(user_ids):
+    """Пересчитывает суммы списков покупок пользователей с нуля."""
+    ShoppingCartIngredient.objects.filter(user_id__in=user_ids).delete()
+    totals = (
+        ShoppingCart.objects.filter(user_id__in=user_ids)
+        .values('user_id', 'recipe__Recipe_ingredient__ingredient_id')
+        .annotate(total=Sum('recipe__Recipe_ingredient__amount'))
+        .filter(total__gt=0)
+    )
+    ShoppingCartIngredient.objects.bulk_create(
+        ShoppingCartIngredient(
+            user_id=row['user_id'],
+            ingredient_id=row['recipe__Recipe_ingredient__ingredient_id'],
+            amount=row['total'],
+        )
+        for row in totals.iterator()
+    )
+    bump_cart_versions(user_ids)
+
+
+def change_recipe_counters(model, recipe_ids, delta):
+    """Сдвигает счётчик избранного или списков покупок у рецептов."""
+    if not recipe_ids:
+        return
+    field = COUNTER_FIELDS[model]
+    Recipe.objects.filter(id__in=recipe_ids).update(
+        **{field: F(field) + delta})
+    bump_recipe_counters_versions(recipe_ids)
+
+
+def count_recipe_links(model):
+    """Выражение с фактическим количеством связей рецепта с ``model``."""
+    return Coalesce(Subquery(
+        model.objects.filter(recipe=OuterRef('pk')).order_by()
+        .values('recipe').annotate(total=Count('id')).values('total')
+    ), 0)
+
+
+@transaction.atomic
+def forget_user_recipes(user):
+    """Вычитает избранное и список покупок пользователя из счётчиков.
+
+    Вызывается перед удалением пользователя: его связи с рецептами
+    удаляются каскадом, минуя сервисные функции.
+    """
+    for model in COUNTER_FIELDS:
+        change_recipe_counters(
+            model,
+            list(model.objects.filter(user=user).values_list(
+                'recipe_id', flat=True)),
+            -1
+        )
+
+
+def add_recipe(model, user, recipe):
+    """Добавляет рецепт в избранное или список покупок одной вставкой.
+
+    Возвращает созданную связь или None, если рецепт уже был добавлен:
+    повторную вставку отклоняет уникальное ограничение, поэтому
+    отдельная проверка не нужна.
+    """
+    try:
+        with transaction.atomic():
+            link = model.objects.create(user=user, recipe=recipe)
+            change_recipe_counters(model, [recipe.id], 1)
+            if model is ShoppingCart:
+                add_to_shopping_cart(user, [recipe.id])
+    except IntegrityError:
+        return None
+    bump_user_flags_version(user.id)
+    return link
+
+
+def remove_recipe(model, user, recipe_id):
+    """Удаляет рецепт из избранного или списка покупок одним запросом.
+
+    Возвращает False, если удалять было нечего.
+    """
+    with transaction.atomic():
+        deleted, _ = model.objects.filter(
+            user=user, recipe_id=recipe_id).delete()
+        if deleted:
+            change_recipe_counters(model, [recipe_id], -1)
+            if model is ShoppingCart:
+                remove_from_shopping_cart(user, [recipe_id])
+    if not deleted:
+        return False
+    bump_user_flags_version(user.id)
+    return True
+
+
+@transaction.atomic
+def recount_recipe_counters(recipe_ids):
+    """Пересчитывает счётчики рецептов по таблицам связей.
+
+    Возвращает количество рецептов, у которых счётчики расходились.
+    """
+    actual = {
+        f'actual_{field}': count_recipe_links(model)
+        for model, field in COUNTER_FIELDS.items()
+    }
+    stale = [
+        recipe for recipe in Recipe.objects.filter(id__in=recipe_ids)
+        .annotate(**actual).only(*COUNTER_FIELDS.values())
+        if any(getattr(recipe, field) != getattr(recipe, f'actual_{field}')
+               for field in COUNTER_FIELDS.values())
+    ]
+    for recipe in stale:
+        for field in COUNTER_FIELDS.values():
+            setattr(recipe, field, getattr(recipe, f'actual_{field}'))
+    Recipe.objects.bulk_update(stale, list(COUNTER_FIELDS.values()))
+    bump_recipe_counters_versions([recipe.id for recipe in stale])
+    return len(stale)
+
+
+def get_recipe_links(model, user, recipe_ids):
+    """Возвращает {id рецепта: есть ли связь} одним запросом.
+
+    Рецептов, которых нет в базе, в результате нет.
+    """
+    return dict(
+        Recipe.objects.filter(id__in=recipe_ids).annotate(
+            linked=Exists(model.objects.filter(
+                user=user, recipe=OuterRef('pk')))
+        ).values_list('id', 'linked')
+    )
+
+
+@transaction.atomic
+def add_recipes(model, user, recipe_ids):
+    """Добавляет рецепты в избранное или список покупок пачкой.
+
+    Вставка с ``ignore_conflicts`` не сообщает, какие строки добавлены,
+    поэтому новые связи определяются чтением до неё. Чтобы параллельные
+    пакетные запросы не посчитали одни и те же связи новыми дважды,
+    они выполняются по очереди под блокировкой строки пользователя.
+
+    Возвращает {id рецепта: статус} для каждого переданного id.
+    """
+    User.objects.select_for_update().only('id').get(pk=user.pk)
+    links = get_recipe_links(model, user, recipe_ids)
+    new = [recipe_id for recipe_id, linked in links.items() if not linked]
+    model.objects.bulk_create(
+        [model(user=user, recipe_id=recipe_id) for recipe_id in new],
+        ignore_conflicts=True
+    )
+    if new:
+        change_recipe_counters(model, new, 1)
+        if model is ShoppingCart:
+            add_to_shopping_cart(user, new)
+        bump_user_flags_version(user.id)
+    return {
+        recipe_id: (NOT_FOUND if recipe_id not in links
+                    else EXISTS if links[recipe_id] else ADDED)
+        for recipe_id in recipe_ids
+    }
+
+
+@transaction.atomic
+def remove_recipes(model, user, recipe_ids):
+    """Удаляет рецепты из избранного или списка покупок пачкой.
+
+    Удаляемые связи блокируются перед удалением: параллельное удаление
+    тех же связей дождётся фиксации и уже не найдёт их, поэтому
+    счётчики и списки покупок уменьшаются один раз.
+
+    Возвращает {id рецепта: статус} для каждого переданного id.
+    """
+    links = get_recipe_links(model, user, recipe_ids)
+    linked = list(
+        model.objects.select_for_update().filter(
+            user=user, recipe_id__in=links
+        ).values_list('recipe_id', flat=True)
+    )
+    if linked:
+        model.objects.filter(user=user, recipe_id__in=linked).delete()
+        change_recipe_counters(model, linked, -1)
+        if model is ShoppingCart:
+            remove_from_shopping_cart(user, linked)
+        bump_user_flags_version(user.id)
+    return {
+        recipe_id: (NOT_FOUND if recipe_id not in links
+                    else REMOVED if recipe_id in linked else ABSENT)
+        for recipe_id in recipe_ids
+    }
+
+
+def get_recipe_previews(author_ids, limit=None):
+    """Возвращает {id автора: [рецепты]} для превью в подписках.
+
+    Первые ``limit`` рецептов каждого автора в порядке публикации
+    выбираются одним запросом с ``ROW_NUMBER() OVER (PARTITION BY ...)``.
+    """
+    previews = {author_id: [] for author_id in author_ids}
+    if not previews:
+        return previews
+    if limit is None:
+        recipes = Recipe.objects.filter(author_id__in=previews).only(
+            *PREVIEW_COLUMNS).order_by('-pub_date', '-id')
+    else:
+        columns = ', '.join(PREVIEW_COLUMNS)
+        placeholders = ', '.join(['%s'] * len(previews))
+        recipes = Recipe.objects.raw(
+            f'SELECT {columns} FROM ('
+            f'SELECT {columns}, ROW_NUMBER() OVER ('
+            f'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+            f') AS row_number FROM {Recipe._meta.db_table} '
+            f'WHERE author_id IN ({placeholders})'
+            f') ranked WHERE row_number <= %s '
+            f'ORDER BY author_id, row_number',
+            [*previews, limit]
+        )
+    for recipe in recipes:
+        previews[recipe.author_id].append(recipe)
+    return previews
@@ -0,0 +1,101 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from users.models import Follow, User
+from .cache import (INGREDIENTS_VERSION, RECIPES_VERSION, TAGS_VERSION,
+                    TRENDING_VERSION, bump_cart_versions,
+                    bump_recipe_version, bump_user_version, bump_version)
+from .catalogues import ingredient_index, tag_catalogue
+from .feed import fan_out_recipe, restore_fan_out
+from .images import schedule_derivatives
+from .models import (Ingredient, IngredientInRecipe, Recipe,
+                     RecipeIngredient, ShoppingCart, Tag)
+from .search import ingredient_search_index
+from .services import (forget_user_recipes,
+                       remove_recipe_from_shopping_carts)
+from backend.constants import AVATAR_IMAGE_SIZES, RECIPE_IMAGE_SIZES
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    """Обновляет версию рецепта, а при создании — кэш количества и ленты,
+    при изменении — версии списков покупок с этим рецептом.
+
+    Уменьшенные копии картинки создаются после фиксации транзакции,
+    и версия рецепта обновляется ещё раз, когда они готовы.
+    """
+    schedule_derivatives(instance, 'image', 'image_derivatives',
+                         RECIPE_IMAGE_SIZES, bump_recipe_version)
+    bump_recipe_version(instance.id)
+    if created:
+        bump_version(RECIPES_VERSION)
+        fan_out_recipe(instance)
+    else:
+        # Название рецепта выводится в закэшированных списках покупок.
+        bump_cart_versions(ShoppingCart.objects.filter(
+            recipe=instance).values_list('user_id', flat=True))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    """Вычитает удаляемый рецепт из списков покупок."""
+    remove_recipe_from_shopping_carts(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Сбрасывает кэш количества рецептов при удалении рецепта."""
+    bump_version(RECIPES_VERSION, TRENDING_VERSION)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, **kwargs):
+    """Обновляет версии рецепта при изменении его тегов."""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_recipe_version(instance.id)
+        bump_version(RECIPES_VERSION)
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    """Обновляет версию рецепта при изменении его ингредиентов."""
+    bump_recipe_version(instance.recipe_id)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_version(TAGS_VERSION)
+    tag_catalogue.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    bump_version(INGREDIENTS_VERSION)
+    ingredient_index.invalidate()
+    ingredient_search_index.invalidate()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    """Обновляет версию профиля, вложенного в рецепты автора."""
+    schedule_derivatives(instance, 'avatar', 'avatar_derivatives',
+                         AVATAR_IMAGE_SIZES, bump_user_version)
+    bump_user_version(instance.id)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    """Вычитает связи удаляемого пользователя из счётчиков рецептов."""
+    forget_user_recipes(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    """Возвращает рассылку в ленты, если автор опустился до порога."""
+    restore_fan_out(instance.author_id)
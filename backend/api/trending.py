@@ -0,0 +1,136 @@
+"""Рейтинг популярных рецептов с затуханием во времени.
+
+Вклад события — добавления рецепта в избранное или список покупок —
+уменьшается вдвое за ``TRENDING_HALF_LIFE`` секунд. Затухание одинаково
+для всех событий, поэтому рейтинг обновляется инкрементально: накопленные
+значения умножаются на общий коэффициент за время с последней отметки,
+и к ним прибавляются вклады только новых событий.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import TRENDING_VERSION, bump_version
+from .models import (Favourites, ShoppingCart, TrendingScore,
+                     TrendingWatermark)
+from backend.constants import (IMPORT_BATCH_SIZE, TRENDING_CART_WEIGHT,
+                               TRENDING_COMMIT_LAG, TRENDING_FAVORITE_WEIGHT,
+                               TRENDING_HALF_LIFE, TRENDING_HISTORY,
+                               TRENDING_MIN_SCORE)
+
+logger = logging.getLogger(__name__)
+
+EVENT_WEIGHTS = (
+    (Favourites, TRENDING_FAVORITE_WEIGHT),
+    (ShoppingCart, TRENDING_CART_WEIGHT),
+)
+
+
+def decay(seconds):
+    """Коэффициент затухания за ``seconds`` секунд."""
+    return 0.5 ** (seconds / TRENDING_HALF_LIFE)
+
+
+def collect_increments(since, now):
+    """Суммирует вклады событий из промежутка (since, now] по рецептам.
+
+    Записи без даты добавления (созданные до её появления) не учитываются.
+    """
+    increments = defaultdict(float)
+    for model, weight in EVENT_WEIGHTS:
+        events = model.objects.filter(
+            pub_date__gt=since, pub_date__lte=now
+        ).values_list('recipe_id', 'pub_date')
+        for recipe_id, pub_date in events.iterator():
+            increments[recipe_id] += weight * decay(
+                (now - pub_date).total_seconds())
+    return increments
+
+
+@transaction.atomic
+def update_trending(now=None, min_interval=0):
+    """Переносит рейтинг от последней отметки к моменту ``now``.
+
+    Отметка ставится на ``TRENDING_COMMIT_LAG`` секунд раньше ``now``:
+    дата события назначается до фиксации его транзакции, и без запаса
+    событие, зафиксированное после пересчёта, осталось бы за отметкой.
+
+    Возвращает количество рецептов с новыми событиями или None, если
+    с прошлого пересчёта прошло меньше ``min_interval`` секунд.
+    Единственная строка отметки создаётся заранее и блокируется,
+    поэтому параллельные пересчёты выполняются по очереди.
+    """
+    now = (now or timezone.now()) - timedelta(seconds=TRENDING_COMMIT_LAG)
+    TrendingWatermark.objects.get_or_create(
+        pk=1,
+        defaults={'computed_at': now - timedelta(seconds=TRENDING_HISTORY)}
+    )
+    watermark = TrendingWatermark.objects.select_for_update().get(pk=1)
+    elapsed = (now - watermark.computed_at).total_seconds()
+    if elapsed < max(min_interval, 0):
+        return None
+
+    TrendingScore.objects.update(score=F('score') * decay(elapsed))
+    increments = collect_increments(watermark.computed_at, now)
+    scores = TrendingScore.objects.in_bulk(list(increments))
+    for recipe_id, trending in scores.items():
+        trending.score += increments[recipe_id]
+    TrendingScore.objects.bulk_update(
+        scores.values(), ['score'], batch_size=IMPORT_BATCH_SIZE)
+    TrendingScore.objects.bulk_create(
+        [TrendingScore(recipe_id=recipe_id, score=score)
+         for recipe_id, score in increments.items()
+         if recipe_id not in scores],
+        batch_size=IMPORT_BATCH_SIZE
+    )
+    TrendingScore.objects.filter(score__lt=TRENDING_MIN_SCORE).delete()
+
+    watermark.computed_at = now
+    watermark.save()
+    bump_version(TRENDING_VERSION)
+    return len(increments)
+
+
+class TrendingScheduler(threading.Thread):
+    """Фоновый поток, периодически пересчитывающий рейтинг."""
+
+    def __init__(self, interval):
+        super().__init__(name='trending-scheduler', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                update_trending(min_interval=self.interval / 2)
+            except Exception:
+                # Ошибка одного пересчёта не должна останавливать поток.
+                logger.exception('Не удалось пересчитать рейтинг рецептов.')
+            finally:
+                connection.close()
+
+    def stop(self):
+        self.stopped.set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(interval):
+    """Запускает поток пересчёта рейтинга, если он ещё не запущен.
+
+    Несколько процессов могут запускать свои потоки: лишние пересчёты
+    отсекаются по ``min_interval``.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TrendingScheduler(interval)
+            _scheduler.start()
+    return _scheduler
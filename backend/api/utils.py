@@ -1,19 +1,79 @@
+import csv
+import json
 from datetime import datetime as dt
 
+from django.core.cache import cache
 
-def render_shopping_list(ingredients, recipes):
-
-    return '\n'.join([
-        f"Список покупок составлен: {dt.now().strftime('%d-%m-%Y')}",
-        "Список продуктов:"
-    ] + [
-        f'{index}.'
-        f' {ingredient["ingredient__name"].capitalize()}'
-        f'— {ingredient["total_amount"]}'
-        f' {ingredient["ingredient__measurement_unit"]}'
-        for index, ingredient in enumerate(ingredients, 1)
-    ] + [
-        'Рецепты, для которых составлен список покупок:'
-    ] + [
-        f'{index}. {recipe.name}' for index, recipe in enumerate(recipes, 1)
-    ])
+
+class Echo:
+    """Файлоподобный объект, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_shopping_list(ingredients, recipes, file_format='txt'):
+    """Построчно формирует список покупок в выбранном формате.
+
+    Возвращает генератор строк, поэтому ingredients и recipes
+    могут быть итераторами по queryset.
+    """
+    renderers = {
+        'txt': render_shopping_list_text,
+        'csv': render_shopping_list_csv,
+        'json': render_shopping_list_json,
+    }
+    return renderers[file_format](ingredients, recipes)
+
+
+def render_shopping_list_text(ingredients, recipes):
+    yield f"Список покупок составлен: {dt.now().strftime('%d-%m-%Y')}\n"
+    yield "Список продуктов:\n"
+    for index, ingredient in enumerate(ingredients, 1):
+        yield (
+            f'{index}.'
+            f' {ingredient["ingredient__name"].capitalize()}'
+            f'— {ingredient["total_amount"]}'
+            f' {ingredient["ingredient__measurement_unit"]}\n'
+        )
+    yield 'Рецепты, для которых составлен список покупок:'
+    for index, recipe in enumerate(recipes, 1):
+        yield f'\n{index}. {recipe.name}'
+
+
+def render_shopping_list_csv(ingredients, recipes):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['total_amount'],
+        ))
+
+
+def render_shopping_list_json(ingredients, recipes):
+    yield '{"date": %s, "ingredients": [' % json.dumps(
+        dt.now().strftime('%Y-%m-%d')
+    )
+    for index, ingredient in enumerate(ingredients):
+        yield (', ' if index else '') + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+            'amount': ingredient['total_amount'],
+        }, ensure_ascii=False)
+    yield '], "recipes": ['
+    for index, recipe in enumerate(recipes):
+        yield (', ' if index else '') + json.dumps(
+            {'id': recipe.id, 'name': recipe.name}, ensure_ascii=False
+        )
+    yield ']}'
+
+
+def cache_stream(chunks, key, timeout):
+    """Отдаёт куски потока и сохраняет их в кэш после завершения."""
+    rendered = []
+    for chunk in chunks:
+        rendered.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(rendered), timeout)
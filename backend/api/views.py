@@ -1,24 +1,51 @@
+import io
+from datetime import datetime as dt
+
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
-from django.http import FileResponse, JsonResponse
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import (SAFE_METHODS, IsAdminUser,
+                                        IsAuthenticated)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
 from users.models import Follow, User
+from .cache import (CART_VERSION, FOLLOWS_VERSION, INGREDIENTS_VERSION,
+                    RECIPE_COUNTERS_VERSION, RECIPE_VERSION, RECIPES_VERSION,
+                    TAGS_VERSION, TRENDING_VERSION, USER_VERSION,
+                    bump_version, get_versions, make_key)
+from .catalogues import ingredient_index, tag_catalogue
+from .feed import backfill_feed, clear_feed, get_feed
 from .filters import IngredientFilter, RecipeFilter
-from .models import Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag
+from .importers import read_json_lines
+from .mixins import ConditionalGetMixin
+from .models import (Favourites, Ingredient, IngredientInRecipe, Recipe,
+                     ShoppingCart, Tag)
 from .paginations import CustomPagination
 from .permissions import AuthorOrReadOnly
-from .serializers import (AvatarSerializer, FavoriteSerializer,
-                          FollowSerializer, IngredientSerializer,
+from .recipe_import import RecipeImporter
+from .renderers import CSVRenderer, PlainTextRenderer
+from .search import search_ingredients
+from .services import (add_recipe, add_recipes, get_recipe_previews,
+                       remove_recipe, remove_recipes)
+from .serializers import (AvatarSerializer, FollowSerializer,
+                          IngredientSerializer, RecipeIdsSerializer,
                           RecipeReadSerializer, RecipeWriteSerializer,
-                          ShortRecipeSerializer, TagSerializer, UserSerializer)
-from .utils import render_shopping_list
+                          ShortRecipeSerializer, TagSerializer,
+                          UserSerializer, get_recipes_limit)
+from .utils import cache_stream, render_shopping_list
+from backend.constants import (INGREDIENT_SEARCH_LIMIT, RECIPE_IN_FAVORITE,
+                               RECIPE_ORDERING_FIELDS,
+                               SHOPPING_LIST_CACHE_TIMEOUT)
 
 
 class UserViewSet(UserViewSet):
@@ -26,6 +53,7 @@ class UserViewSet(UserViewSet):
     permission_classes = (permissions.AllowAny,)
     serializer_class = UserSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('username', 'id')
 
     def get_permissions(self):
         if self.action == "me":
@@ -68,10 +96,14 @@ class UserViewSet(UserViewSet):
                 return Response(status=status.HTTP_400_BAD_REQUEST)
             serializer = FollowSerializer(author, context={"request": request})
             Follow.objects.create(user=user, author=author)
+            backfill_feed(user, author)
+            bump_version(FOLLOWS_VERSION.format(user_id=user.id))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         if not is_subscribed:
             return Response(status=status.HTTP_400_BAD_REQUEST)
         user.follower.filter(author=author).delete()
+        clear_feed(user, author)
+        bump_version(FOLLOWS_VERSION.format(user_id=user.id))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -80,24 +112,66 @@ class UserViewSet(UserViewSet):
         permission_classes=[IsAuthenticated],
     )
     def subscriptions(self, request):
+        """Подписки пользователя с превью рецептов авторов.
+
+        Количество рецептов считается подзапросом, превью всех авторов
+        страницы выбираются одним запросом, а ``is_subscribed`` заранее
+        известен, поэтому число запросов не зависит от размера страницы.
+        """
         user = request.user
-        queryset = User.objects.filter(following__user=user)
-        paginated_queryset = self.paginate_queryset(queryset)
+        queryset = User.objects.filter(following__user=user).annotate(
+            recipes_count=Coalesce(Subquery(
+                Recipe.objects.filter(author=OuterRef('pk')).order_by()
+                .values('author').annotate(total=Count('id'))
+                .values('total')
+            ), 0)
+        ).order_by('username', 'id')
+        authors = self.paginate_queryset(queryset)
+        author_ids = [author.id for author in authors]
         serializer = FollowSerializer(
-            paginated_queryset, many=True, context={"request": request}
+            authors, many=True, context={
+                "request": request,
+                "subscriptions": set(author_ids),
+                "recipe_previews": get_recipe_previews(
+                    author_ids, get_recipes_limit(request)),
+            }
         )
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     """Вьюсет тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (permissions.AllowAny,)
     pagination_class = None
 
+    def get_condition_versions(self):
+        return (TAGS_VERSION,)
+
+    def list(self, request, *args, **kwargs):
+        """Отдаёт теги из справочника процесса."""
+        return self.conditional_response(self.list_tags, request)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.retrieve_tag, request, *args, **kwargs
+        )
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+    def list_tags(self, request):
+        return Response(tag_catalogue.all())
+
+    def retrieve_tag(self, request, pk):
+        try:
+            tag = tag_catalogue.get(int(pk))
+        except ValueError:
+            tag = None
+        if tag is None:
+            raise NotFound
+        return Response(tag)
+
+
+class IngredientViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     """Вьюсет ингридиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -105,10 +179,58 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def get_condition_versions(self):
+        return (INGREDIENTS_VERSION,)
+
+    def list(self, request, *args, **kwargs):
+        """Отдаёт ингредиенты из индекса процесса.
+
+        Параметр ``name`` ищет по началу названия без учёта регистра,
+        ``search`` — ранжированный нечёткий поиск, ``limit`` ограничивает
+        количество результатов.
+        """
+        return self.conditional_response(self.list_ingredients, request)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.retrieve_ingredient, request, *args, **kwargs
+        )
+
+    def list_ingredients(self, request):
+        name = request.query_params.get('name')
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = None
+        if limit is not None and limit <= 0:
+            limit = None
+        search = request.query_params.get('search')
+        if search:
+            return Response(search_ingredients(
+                search, limit or INGREDIENT_SEARCH_LIMIT
+            ))
+        if name:
+            return Response(ingredient_index.search(name, limit))
+        return Response(ingredient_index.all()[:limit])
+
+    def retrieve_ingredient(self, request, pk):
+        try:
+            ingredient = ingredient_index.get(int(pk))
+        except ValueError:
+            ingredient = None
+        if ingredient is None:
+            raise NotFound
+        return Response(ingredient)
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """Вьюсет рецептов."""
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        Prefetch(
+            'ingredient_list',
+            queryset=IngredientInRecipe.objects.select_related('ingredient')
+        ),
+    )
     permission_classes = (AuthorOrReadOnly,)
     serializer_class = RecipeReadSerializer
     filterset_class = RecipeFilter
@@ -116,22 +238,72 @@ class RecipeViewSet(viewsets.ModelViewSet):
         'is_in_shopping_cart', 'is_favorited', 'tags', 'author'
     )
     pagination_class = CustomPagination
+    count_cache_user_params = ('is_favorited', 'is_in_shopping_cart')
+    condition_per_user = True
 
     def get_queryset(self):
-        """
-        Переопределяем get_queryset, чтобы корректно фильтровать рецепты.
+        """Аннотирует рецепты флагами избранного и списка покупок.
+
+        Флаги вычисляются одним запросом через подзапросы ``Exists``;
+        для анонимного пользователя аннотации не добавляются.
         """
         queryset = super().get_queryset()
         user = self.request.user
-
-        is_in_shopping_cart = self.request.query_params.get(
-            'is_in_shopping_cart')
-        if is_in_shopping_cart and user.is_authenticated:
-            return queryset
-        is_favorited = self.request.query_params.get(
-            'is_favorited')
-        if is_favorited and not user.is_anonymous:
+        if user.is_anonymous:
             return queryset
+        return queryset.annotate(
+            is_favorited=Exists(Favourites.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    @property
+    def count_cache_scope(self):
+        if self.action == 'feed':
+            return None
+        if self.action == 'trending':
+            return TRENDING_VERSION
+        return RECIPES_VERSION
+
+    @property
+    def approximate_count(self):
+        """Оценка количества по статистике таблицы рецептов.
+
+        Подходит только для полного списка рецептов.
+        """
+        return self.action == 'list'
+
+    @property
+    def cursor_ordering(self):
+        """Порядок курсорной пагинации с учётом параметра ``ordering``."""
+        if self.action == 'trending':
+            return ('-trending_score', '-id')
+        if self.action == 'feed':
+            return ('-feed_date', '-feed_recipe_id')
+        ordering = [
+            field for field in
+            self.request.query_params.get('ordering', '').split(',')
+            if field.lstrip('-') in RECIPE_ORDERING_FIELDS
+        ]
+        return (*ordering, '-id') if ordering else ('-pub_date', '-id')
+
+    def get_condition_versions(self):
+        """Версии рецепта для условного запроса одного рецепта."""
+        if self.action != 'retrieve':
+            return None
+        recipe_id = self.kwargs[self.lookup_field]
+        if not recipe_id.isdigit():
+            # Ответ 404 вернёт обычный поиск объекта.
+            return None
+        author_id = Recipe.objects.filter(pk=recipe_id).values_list(
+            'author_id', flat=True).first()
+        if author_id is None:
+            return None
+        return (RECIPE_VERSION.format(recipe_id=recipe_id),
+                RECIPE_COUNTERS_VERSION.format(recipe_id=recipe_id),
+                USER_VERSION.format(user_id=author_id),
+                TAGS_VERSION, INGREDIENTS_VERSION)
 
     def get_serializer_class(self):
         if self.request.method in ('POST', 'PUT', 'PATCH'):
@@ -139,30 +311,71 @@ class RecipeViewSet(viewsets.ModelViewSet):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
 
+    @action(
+        methods=['post'],
+        detail=False,
+        url_path='import',
+        permission_classes=[IsAdminUser],
+        parser_classes=[MultiPartParser],
+    )
+    def import_recipes(self, request):
+        """Импортирует рецепты из загруженного файла JSON Lines.
+
+        Файл передаётся в поле ``file``; строки без автора создаются
+        от имени администратора. В ответе — отчёт с ошибками по строкам.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response(
+                {'errors': 'Передайте файл JSON Lines в поле file.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        lines = read_json_lines(
+            io.TextIOWrapper(upload.file, encoding='utf8', errors='replace'))
+        report = RecipeImporter(default_author=request.user).run(lines)
+        return Response(report.as_dict())
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь.
+
+        Фильтры списка рецептов применяются, параметр ``ordering`` — нет.
+        """
+        queryset = get_feed(
+            self.filter_queryset(self.get_queryset()), request.user
+        ).order_by('-feed_date', '-feed_recipe_id')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def trending(self, request):
+        """Популярные рецепты по убыванию затухающего рейтинга.
+
+        Рейтинг заранее рассчитывает команда update_trending; фильтры
+        списка рецептов применяются, параметр ``ordering`` — нет.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).annotate(
+            trending_score=F('trending__score')
+        ).filter(trending_score__isnull=False).order_by(
+            '-trending_score', '-id')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(
         methods=["POST", "DELETE"],
         detail=True,
         permission_classes=[IsAuthenticated],
     )
     def favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        user = request.user
         if request.method == "POST":
-            serializer = FavoriteSerializer(
-                data={"user": user.id, "recipe": recipe.id}
-            )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if request.method == "DELETE":
-            is_favorited = user.favourites.filter(recipe=recipe)
-            if is_favorited.exists():
-                is_favorited.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(
-                data={"errors": "Этого рецепта нет в избранном."},
-                status=status.HTTP_400_BAD_REQUEST,
+            return self.add_recipe_response(
+                Favourites, request, pk, RECIPE_IN_FAVORITE
             )
+        return self.remove_recipe_response(
+            Favourites, request, pk, "Этого рецепта нет в избранном."
+        )
 
     @action(
         methods=['post', 'delete'],
@@ -171,47 +384,118 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def shopping_cart(self, request, pk):
         if request.method == 'DELETE':
-            recipe = get_object_or_404(Recipe, pk=pk)
-            try:
-                fav_recipe = ShoppingCart.objects.get(
-                    recipe=recipe, user=request.user
-                )
-                fav_recipe.delete()
-            except BaseException:
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            return self.remove_recipe_response(
+                ShoppingCart, request, pk,
+                'Этого рецепта нет в списке покупок.'
+            )
+        return self.add_recipe_response(
+            ShoppingCart, request, pk, 'Рецепт уже добавлен!'
+        )
 
+    def add_recipe_response(self, model, request, pk, error):
+        """Добавляет рецепт одной вставкой; повтор даёт 400."""
         recipe = get_object_or_404(Recipe, pk=pk)
-        created = ShoppingCart.objects.get_or_create(
-            recipe=recipe, user=request.user)
-        if not created[-1]:
+        if not add_recipe(model, request.user, recipe):
             return Response(
-                {'errors': 'Рецепт уже добавлен!'},
-                status.HTTP_400_BAD_REQUEST
+                {'errors': error}, status=status.HTTP_400_BAD_REQUEST
             )
         serializer = ShortRecipeSerializer(
             recipe, context={'request': request}
         )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    @action(detail=False, methods=['get'])
+    def remove_recipe_response(self, model, request, pk, error):
+        """Удаляет рецепт одним запросом; 404 или 400, если удалять нечего."""
+        if remove_recipe(model, request.user, pk):
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, pk=pk)
+        return Response(
+            {'errors': error}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='favorite',
+        permission_classes=[IsAuthenticated]
+    )
+    def bulk_favorite(self, request):
+        """Добавляет или удаляет пачку рецептов в избранном."""
+        return self.bulk_response(Favourites, request)
+
+    @action(
+        methods=['post', 'delete'],
+        detail=False,
+        url_path='shopping_cart',
+        permission_classes=[IsAuthenticated]
+    )
+    def bulk_shopping_cart(self, request):
+        """Добавляет или удаляет пачку рецептов в списке покупок."""
+        return self.bulk_response(ShoppingCart, request)
+
+    def bulk_response(self, model, request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        change = add_recipes if request.method == 'POST' else remove_recipes
+        statuses = change(
+            model, request.user, serializer.validated_data['recipes']
+        )
+        return Response({'results': [
+            {'id': recipe_id, 'status': recipe_status}
+            for recipe_id, recipe_status in statuses.items()
+        ]})
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+        renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer),
+    )
     def download_shopping_cart(self, request):
+        """Потоково отдаёт список покупок.
+
+        Формат выбирается параметром ``format`` (txt, csv, json)
+        или заголовком Accept; по умолчанию — текст. Готовый список
+        кэшируется по версиям списка покупок пользователя и справочника
+        ингредиентов; изменение рецепта обновляет версии списков, в
+        которых он есть.
+        """
         user = request.user
-        shopping_cart = ShoppingCart.objects.filter(user=user)
-        if not shopping_cart.exists():
-            raise ValidationError({'status': 'Ваш список покупок пуст'})
-
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in=shopping_cart.values_list('recipe', flat=True)).values(
-            'ingredient__name',
-            'ingredient__measurement_unit').annotate(total_amount=Sum('amount')
-                                                     )
-
-        recipes = Recipe.objects.filter(
-            id__in=shopping_cart.values_list('recipe', flat=True))
-        return FileResponse(render_shopping_list(ingredients, recipes),
-                            content_type='text/plain',
-                            filename='shopping_list.txt')
+        renderer = request.accepted_renderer
+        cart_version = CART_VERSION.format(user_id=user.id)
+        versions = get_versions(cart_version, INGREDIENTS_VERSION)
+        cache_key = make_key(
+            'shopping_list', user.id, renderer.format,
+            dt.now().strftime('%Y-%m-%d'),
+            versions[cart_version], versions[INGREDIENTS_VERSION]
+        )
+        content = cache.get(cache_key)
+        if content is None:
+            shopping_cart = ShoppingCart.objects.filter(user=user)
+            if not shopping_cart.exists():
+                raise ValidationError({'status': 'Ваш список покупок пуст'})
+
+            ingredients = user.shopping_cart_ingredients.values(
+                'ingredient__name', 'ingredient__measurement_unit',
+                total_amount=F('amount')
+            ).order_by('ingredient__name')
+
+            recipes = Recipe.objects.filter(
+                id__in=shopping_cart.values_list('recipe', flat=True))
+            content = cache_stream(
+                render_shopping_list(ingredients.iterator(),
+                                     recipes.iterator(), renderer.format),
+                cache_key, SHOPPING_LIST_CACHE_TIMEOUT
+            )
+        else:
+            content = [content]
+        response = StreamingHttpResponse(
+            content, content_type=f'{renderer.media_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        return response
 
     @action(
         detail=True,
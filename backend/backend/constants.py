@@ -10,6 +10,7 @@ COOKING_TIME_MIN_ERROR = (
 )
 TAG_ERROR = 'Рецепт не может быть без тегов!'
 TAG_UNIQUE_ERROR = 'Теги должны быть уникальными!'
+INGREDIENT_ERROR = 'Рецепт не может быть без ингредиентов!'
 ALREADY_BUY = 'Вы уже добавили рецепт в список покупок.'
 LENG_MAX = 200
 MAX_LENG = 32
@@ -31,3 +32,47 @@ LIMITED_NUMBER_OF_CHARACTERS = f'Набор символов не более {LE
 LENG_EMAIL = 254
 MAX_AMOUNT = 32000
 PAGINATION_NUMBER = 6
+INVALID_CURSOR = 'Неверный курсор.'
+COUNT_CACHE_TIMEOUT = 60
+APPROXIMATE_COUNT_MIN = 10000
+RECIPE_FRAGMENT_TIMEOUT = 60 * 60 * 24
+CATALOGUE_CHECK_INTERVAL = 5
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SEARCH_MAX_CANDIDATES = 5000
+INGREDIENT_SEARCH_MAX_POSTING = 5000
+INGREDIENT_SEARCH_SIMILARITY = 0.3
+IMPORT_BATCH_SIZE = 1000
+IMPORT_READ_CHUNK_SIZE = 64 * 1024
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+BULK_MAX_RECIPES = 100
+RECIPE_ORDERING_FIELDS = ('pub_date', 'favorites_count', 'in_carts_count')
+TRENDING_HALF_LIFE = 24 * 60 * 60
+TRENDING_HISTORY = 14 * 24 * 60 * 60
+TRENDING_FAVORITE_WEIGHT = 1.0
+TRENDING_CART_WEIGHT = 1.5
+TRENDING_MIN_SCORE = 0.01
+TRENDING_COMMIT_LAG = 60
+FEED_FANOUT_MAX_FOLLOWERS = 1000
+FEED_BACKFILL_LIMIT = 100
+FEED_CELEBRITIES_CACHE_TIMEOUT = 5 * 60
+IMPORT_IMAGE_WORKERS = 8
+IMPORT_IMAGE_TIMEOUT = 10
+IMPORT_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_DECODE_CHUNK_SIZE = 64 * 1024
+IMAGE_SPOOL_MAX_SIZE = 1024 * 1024
+IMAGE_HEADER_MAX_SIZE = 256 * 1024
+IMAGE_HEADER_ERROR = (
+    'Картинка должна быть передана в виде data:image/<формат>;base64,...'
+)
+IMAGE_DECODE_ERROR = 'Некорректные данные base64.'
+IMAGE_INVALID_ERROR = 'Загрузите корректную картинку в формате {formats}.'
+IMAGE_SIZE_ERROR = 'Размер картинки не должен превышать {max_size} байт.'
+IMAGE_DIMENSIONS_ERROR = (
+    'Картинка должна быть не больше {max_dimension} пикселей по стороне '
+    'и {max_pixels} пикселей в сумме.'
+)
+RECIPE_IMAGE_SIZES = {'card': (400, 400), 'detail': (1200, 1200)}
+AVATAR_IMAGE_SIZES = {'avatar': (200, 200)}
+IMAGE_DERIVATIVE_FORMATS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVES_DIR = 'derivatives'
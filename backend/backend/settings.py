@@ -68,6 +68,35 @@ DATABASES = {
     }
 }
 
+# Версии кэша и закэшированные данные должны быть общими для всех
+# воркеров и management-команд. В docker-compose используется memcached.
+# Без CACHE_BACKEND кэш хранится в базе (таблица создаётся командой
+# createcachetable): он общий, но каждое обращение к нему — запрос к базе.
+# Кэш в памяти процесса подходит только для разработки: см. api.W001.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram_cache'),
+    }
+}
+if 'memcached' not in CACHES['default']['BACKEND']:
+    # Клиент memcached не принимает MAX_ENTRIES; остальным бэкендам нужен
+    # запас, чтобы фрагменты и версии не вытеснялись постоянно.
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100000)),
+    }
+
+INGREDIENT_SEARCH_PG_TRGM = (
+    os.getenv('INGREDIENT_SEARCH_PG_TRGM', 'False') == 'True'
+)
+
+# Период пересчёта рейтинга популярных рецептов фоновым потоком процессов
+# сервера (запускается в wsgi.py), секунды. 0 — поток не запускается,
+# рейтинг обновляет команда update_trending (например, по cron).
+TRENDING_REFRESH_INTERVAL = int(os.getenv('TRENDING_REFRESH_INTERVAL', 0))
+
 AUTH_USER_MODEL = 'users.User'
 
 
@@ -126,4 +155,20 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Ограничения картинок, загружаемых в base64: байты после декодирования,
+# длина стороны и общее число пикселей.
+IMAGE_UPLOAD_MAX_SIZE = int(os.getenv('IMAGE_UPLOAD_MAX_SIZE', 5 * 1024 * 1024))
+IMAGE_UPLOAD_MAX_DIMENSION = int(os.getenv('IMAGE_UPLOAD_MAX_DIMENSION', 6000))
+IMAGE_UPLOAD_MAX_PIXELS = int(os.getenv('IMAGE_UPLOAD_MAX_PIXELS', 24000000))
+
+# Уменьшенные копии картинок создаются фоновым потоком после ответа.
+# False — сразу после фиксации транзакции, в том же запросе.
+IMAGE_DERIVATIVES_ASYNC = (
+    os.getenv('IMAGE_DERIVATIVES_ASYNC', 'True') == 'True'
+)
+
+# Хосты, с которых импорт рецептов может загружать картинки по URL.
+# Пусто — любые хосты с публичными адресами.
+IMPORT_IMAGE_ALLOWED_HOSTS = os.getenv('IMPORT_IMAGE_ALLOWED_HOSTS', '').split()
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
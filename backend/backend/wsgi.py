@@ -5,3 +5,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Поток пересчёта рейтинга нужен только процессам сервера, а не миграциям,
+# shell и другим management-командам, поэтому запускается здесь.
+from django.conf import settings  # noqa: E402
+
+if settings.TRENDING_REFRESH_INTERVAL:
+    from api.trending import start_scheduler  # noqa: E402
+
+    start_scheduler(settings.TRENDING_REFRESH_INTERVAL)
@@ -14,6 +14,11 @@ class User(AbstractUser):
         blank=True,
         verbose_name='Аватар'
     )
+    avatar_derivatives = models.JSONField(
+        'Уменьшенные копии аватара',
+        default=dict,
+        editable=False,
+    )
 
     username = models.CharField(
         "username",